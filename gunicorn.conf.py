@@ -0,0 +1,9 @@
+"""Gunicorn settings for the production server (see Dockerfile)."""
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+# Threaded workers keep serving while other requests wait on PostGIS
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
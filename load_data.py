@@ -2,24 +2,48 @@
 Script to load GeoJSON from data/sec.geojson into PostGIS.
 
 Usage:
-  python load_data.py
+  python load_data.py [--workers N]
+  python load_data.py --refresh-views
+
+  --workers N spreads feature conversion and COPY across N processes, each
+  with its own connection. Batches commit independently, so a failed
+  parallel load can leave a partial table behind.
+
+  --refresh-views only refreshes the materialized views (schools_summary,
+  schools_grid_1000, school_resource_stats); run it nightly from cron to pick
+  up edits.
 
 Requirements:
   - A PostgreSQL database `schools_ke` accessible at the URL configured in `db.py`.
   - The PostGIS extension enabled (the script will try to enable it if allowed).
+
+Fast initial loads:
+  The tables are created in the same transaction as the COPY. When the server
+  runs with `wal_level = minimal`, `max_wal_senders = 0` and `archive_mode = off`
+  in postgresql.conf, PostgreSQL then skips WAL for the new table entirely.
+  wal_level cannot be changed per session, so this is a server-side opt-in.
 """
-import json
+import argparse
+import os
+import struct
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from itertools import islice
+
+import ijson
+import orjson
 from sqlalchemy import text
+from shapely import wkb
 from shapely.geometry import shape
-from geoalchemy2 import WKTElement
 
-from db import engine, SessionLocal, Base
-from models import School
+from db import get_engine, Base
+# importing models registers every table on Base.metadata for create_tables
+from models import COUNTY_KEYS
 
 
 def enable_postgis():
     # Create extension if possible
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         try:
             conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis;"))
             print("Ensured PostGIS extension exists (if allowed).")
@@ -27,62 +51,320 @@ def enable_postgis():
             print("Warning: could not create PostGIS extension:", e)
 
 
-def create_schema():
-    # Create tables from models
-    Base.metadata.create_all(bind=engine)
+def create_tables(conn=None):
+    # Create tables from models; indexes are added after the bulk load
+    Base.metadata.create_all(bind=conn if conn is not None else get_engine())
     print("Created tables (if not existing)")
+
+
+def create_indexes():
+    """Build the spatial and trigram indexes once the data is in place.
+
+    A single sort-based build is far cheaper than maintaining the indexes
+    row by row during the load.
+    """
     # Create a spatial index on the geometry column for faster spatial queries
     try:
-        with engine.begin() as conn:
-            conn.execute(text("CREATE INDEX IF NOT EXISTS schools_geom_gist ON schools USING GIST (geom);"))
-            print("Ensured spatial GIST index on schools.geom")
+        with get_engine().begin() as conn:
+            conn.execute(text(f"SET LOCAL maintenance_work_mem = '{INDEX_BUILD_MEM}';"))
+            conn.execute(text("SET LOCAL statement_timeout = 0;"))
+            # buffering is left at 'auto' so PG14+/PostGIS 3.1+ can use the faster sorted build
+            conn.execute(text("CREATE INDEX IF NOT EXISTS schools_geom_gist ON schools USING GIST (geom) WITH (fillfactor = 90);"))
+            # ST_DWithin(geog, ...) radius filters (search, buffer, dedup) need the geography column indexed
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_schools_geog_gist ON schools USING GIST (geog) WITH (fillfactor = 90);"))
+            print("Ensured spatial GIST indexes on schools.geom and schools.geog")
     except Exception as e:
         print("Warning: could not create spatial index:", e)
     # Create pg_trgm extension and trigram indexes for fuzzy/name search
     try:
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
+            conn.execute(text(f"SET LOCAL maintenance_work_mem = '{INDEX_BUILD_MEM}';"))
+            conn.execute(text("SET LOCAL statement_timeout = 0;"))
             conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
-            conn.execute(text("CREATE INDEX IF NOT EXISTS schools_name_trgm ON schools USING GIN (name gin_trgm_ops);"))
-            conn.execute(text("CREATE INDEX IF NOT EXISTS schools_props_name_trgm ON schools USING GIN ((properties->>'NAME') gin_trgm_ops);"))
-            print("Ensured pg_trgm and trigram GIN indexes on name and properties->>'NAME'")
+            # name_norm already folds in properties->>'NAME', so one index covers both
+            # A 64MB pending list absorbs bulk inserts on reloads; it is flushed after the load
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS schools_name_norm_trgm ON schools USING GIN (name_norm gin_trgm_ops) "
+                "WITH (fastupdate = on, gin_pending_list_limit = 65536);"
+            ))
+            # prefix (autocomplete) searches use a B-tree range scan instead of the GIN
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS idx_schools_name_norm_prefix ON schools (name_norm text_pattern_ops);"
+            ))
+            print("Ensured pg_trgm, trigram GIN and prefix B-tree indexes on name_norm")
     except Exception as e:
         print("Warning: could not create trigram indexes:", e)
 
 
+# Columns written by COPY, in row order
+INSERT_CHUNK_SIZE = 1000
+# Features handed to each worker process in a parallel load
+PARALLEL_BATCH_SIZE = 5000
+# Memory granted to the one-off index builds after the load
+INDEX_BUILD_MEM = '1GB'
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items from `iterable`."""
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Precomputed per-county counts and extents, refreshed after every load
+SUMMARY_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS schools_summary AS
+SELECT COALESCE(county, 'UNKNOWN') AS county,
+       count(*) AS n,
+       ST_SetSRID(ST_Extent(geom)::geometry, 4326) AS bbox
+FROM schools
+GROUP BY 1;
+"""
+# 1 km heat-grid cells (EPSG:3857) served by /schools/heatgrid at the default grid size
+GRID_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS schools_grid_1000 AS
+SELECT ST_X(cell) AS cx, ST_Y(cell) AS cy, cell AS g3857, count(*) AS cnt
+FROM (SELECT ST_SnapToGrid(ST_Transform(ST_Centroid(geom), 3857), 1000, 1000) AS cell
+      FROM schools WHERE geom IS NOT NULL) s
+GROUP BY cell;
+"""
+# School-wide resource averages read by EducationAnalytics.get_resource_distribution;
+# the constant id gives REFRESH ... CONCURRENTLY the unique index it needs
+RESOURCE_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS school_resource_stats AS
+SELECT 1 AS id,
+       AVG(teacher_count)::float8 AS avg_teachers,
+       AVG(staff_count)::float8 AS avg_staff,
+       AVG(classrooms)::float8 AS avg_classrooms,
+       AVG(labs)::float8 AS avg_labs,
+       AVG(libraries)::float8 AS avg_libraries,
+       AVG(computer_labs)::float8 AS avg_computer_labs,
+       AVG(teacher_count * 1.0 / NULLIF(current_enrollment, 0))::float8 AS teacher_student_ratio
+FROM schools;
+"""
+# Property keys that may carry the school name, in order of preference
+NAME_KEYS = ("name", "NAME", "Name")
+# Promoted to columns, so dropped from the stored properties
+PROMOTED_KEYS = frozenset(NAME_KEYS + COUNTY_KEYS)
+# Little-endian EWKB header for a 2D Point with SRID 4326
+POINT_EWKB_PREFIX = "0101000020E6100000"
+
+
+def geometry_ewkb(geom):
+    """Return hex EWKB (SRID 4326) for a GeoJSON geometry.
+
+    2D points, the common case for schools, are packed directly; anything
+    else goes through shapely.
+    """
+    if geom.get("type") == "Point":
+        coords = geom.get("coordinates") or ()
+        if len(coords) == 2:
+            return POINT_EWKB_PREFIX + struct.pack("<dd", coords[0], coords[1]).hex()
+    return wkb.dumps(shape(geom), hex=True, srid=4326)
+
+
+def find_name(props):
+    return next((props[k] for k in NAME_KEYS if props.get(k)), None)
+
+
+def feature_rows(features, now):
+    """Yield one column dict per feature that has a geometry.
+
+    The property holding the school name is resolved from the first feature
+    and reused, so most rows cost a single dict lookup; rows where that key
+    is empty fall back to checking every candidate. Name keys are promoted
+    to the `name` column and county keys to `county`; both are dropped
+    from `properties`.
+    """
+    name_key = None
+    for feat in features:
+        props = feat.get("properties") or {}
+        geom = feat.get("geometry")
+        if not geom:
+            continue
+        if name_key is None:
+            name_key = next((k for k in NAME_KEYS if k in props), NAME_KEYS[0])
+        name = props.get(name_key) or find_name(props)
+        yield {
+            "name": name,
+            "county": next((props[k] for k in COUNTY_KEYS if props.get(k)), None),
+            "properties": {k: v for k, v in props.items() if k not in PROMOTED_KEYS},
+            "geom": geometry_ewkb(geom),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def copy_rows(conn, rows):
+    """Stream rows through COPY FROM STDIN on a raw psycopg connection.
+
+    psycopg flushes the copy buffer as rows are written, so memory stays
+    bounded however many rows the iterator yields. Returns the row count.
+    """
+    count = 0
+    with conn.cursor() as cur:
+        with cur.copy(f"COPY schools ({', '.join(COPY_COLUMNS)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row((
+                    row["name"],
+                    row["county"],
+                    orjson.dumps(row["properties"]).decode(),
+                    row["geom"],
+                    row["created_at"],
+                    row["updated_at"],
+                ))
+                count += 1
+    return count
+
+
 def load_geojson(path="data/sec.geojson"):
-    session = SessionLocal()
+    """Bulk load features into `schools` with COPY.
+
+    Features are parsed incrementally with ijson and streamed straight into
+    COPY, so memory does not grow with the size of the GeoJSON file. Tables
+    are created inside the load transaction so wal_level=minimal servers can
+    skip WAL for them.
+    """
+    print(f"Loading features from {path}...")
+    with get_engine().begin() as conn:
+        # The load can simply be re-run if the server crashes mid-way
+        conn.execute(text("SET LOCAL synchronous_commit = off;"))
+        conn.execute(text("SET LOCAL statement_timeout = 0;"))
+        create_tables(conn)
+        with open(path, "rb") as f:
+            features = ijson.items(f, "features.item", use_float=True)
+            # Bulk paths bypass the ORM, so column defaults have to be supplied here
+            rows = feature_rows(features, datetime.utcnow())
+            # COPY runs on the psycopg 3 driver connection (db.py always selects
+            # that driver), inside the same transaction
+            count = copy_rows(conn.connection.driver_connection, rows)
+    print(f"Inserted {count} features into the database.")
+
+
+def copy_batch(features, now):
+    """Worker task: convert one batch of features and COPY it on its own connection."""
+    with get_engine().begin() as conn:
+        conn.execute(text("SET LOCAL synchronous_commit = off;"))
+        conn.execute(text("SET LOCAL statement_timeout = 0;"))
+        return copy_rows(conn.connection.driver_connection, feature_rows(features, now))
+
+
+def load_geojson_parallel(path="data/sec.geojson", workers=None):
+    """Load features with `workers` processes running concurrent COPY streams.
+
+    The main process only parses the file; geometry encoding and COPY run in
+    the workers. At most two batches per worker are in flight at a time.
+    """
+    workers = workers or os.cpu_count() or 1
+    print(f"Loading features from {path} with {workers} workers...")
+    create_tables()
+    now = datetime.utcnow()
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        with open(path, "rb") as f:
+            features = ijson.items(f, "features.item", use_float=True)
+            pending = set()
+            for batch in batched(features, PARALLEL_BATCH_SIZE):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    count += sum(fut.result() for fut in done)
+                pending.add(pool.submit(copy_batch, batch, now))
+            count += sum(fut.result() for fut in pending)
+    print(f"Inserted {count} features into the database.")
+
+
+def create_summary_view():
+    """Create (or refresh) the per-county summary behind /schools/stats/details and ?county=."""
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text("SET LOCAL statement_timeout = 0;"))
+            conn.execute(text(SUMMARY_VIEW_SQL))
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS schools_summary_county ON schools_summary (county);"))
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY schools_summary;"))
+            print("Refreshed schools_summary materialized view")
+    except Exception as e:
+        print("Warning: could not refresh schools_summary:", e)
+
+
+def create_grid_view():
+    """Create (or refresh) the 1 km heat-grid behind /schools/heatgrid."""
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text("SET LOCAL statement_timeout = 0;"))
+            conn.execute(text(GRID_VIEW_SQL))
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS schools_grid_1000_cell ON schools_grid_1000 (cx, cy);"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS schools_grid_1000_gist ON schools_grid_1000 USING GIST (g3857);"))
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY schools_grid_1000;"))
+            print("Refreshed schools_grid_1000 materialized view")
+    except Exception as e:
+        print("Warning: could not refresh schools_grid_1000:", e)
+
+
+def create_resource_view():
+    """Create (or refresh) the single-row resource averages behind the analytics page."""
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text("SET LOCAL statement_timeout = 0;"))
+            conn.execute(text(RESOURCE_VIEW_SQL))
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS school_resource_stats_id ON school_resource_stats (id);"))
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY school_resource_stats;"))
+            print("Refreshed school_resource_stats materialized view")
+    except Exception as e:
+        print("Warning: could not refresh school_resource_stats:", e)
+
+
+def flush_gin_pending():
+    """Merge GIN pending entries so the first searches don't scan a large pending list."""
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text("SET LOCAL statement_timeout = 0;"))
+            conn.execute(text("SELECT gin_clean_pending_list('schools_name_norm_trgm'::regclass);"))
+            print("Flushed GIN pending list for schools_name_norm_trgm")
+    except Exception as e:
+        print("Warning: could not flush GIN pending list:", e)
+
+
+def cluster_schools():
+    """Physically order `schools` by the GIST index so nearby rows share pages,
+    then refresh planner statistics for the freshly loaded data."""
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            gj = json.load(f)
-
-        features = gj.get("features") or []
-        print(f"Loading {len(features)} features...")
-
-        for feat in features:
-            props = feat.get("properties") or {}
-            geom = feat.get("geometry")
-            if not geom:
-                continue
-            shapely_geom = shape(geom)
-            wkt = WKTElement(shapely_geom.wkt, srid=4326)
-
-            name = props.get("name") or props.get("NAME") or props.get("Name")
-            school = School(name=name, properties=props, geom=wkt)
-            session.add(school)
-
-        session.commit()
-        print("Inserted features into the database.")
-    except Exception:
-        session.rollback()
-        raise
-    finally:
-        session.close()
-
-
-def main():
+        with get_engine().begin() as conn:
+            conn.execute(text("SET LOCAL statement_timeout = 0;"))
+            conn.execute(text("CLUSTER schools USING schools_geom_gist;"))
+            conn.execute(text("ANALYZE schools;"))
+            print("Clustered and analyzed schools on schools_geom_gist")
+    except Exception as e:
+        print("Warning: could not cluster schools table:", e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load data/sec.geojson into PostGIS.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for a parallel load (0 = one per CPU)")
+    parser.add_argument("--refresh-views", action="store_true",
+                        help="only refresh the materialized views, without reloading")
+    args = parser.parse_args(argv)
+
+    if args.refresh_views:
+        create_summary_view()
+        create_grid_view()
+        create_resource_view()
+        return
+
     enable_postgis()
-    create_schema()
-    load_geojson()
+    if args.workers == 1:
+        load_geojson()
+    else:
+        load_geojson_parallel(workers=args.workers)
+    create_indexes()
+    flush_gin_pending()
+    cluster_schools()
+    create_summary_view()
+    create_grid_view()
+    create_resource_view()
 
 
 if __name__ == "__main__":
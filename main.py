@@ -1,76 +1,293 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, make_response, render_template, request, stream_with_context
 from flask_cors import CORS
+from flask_compress import Compress
 import json
 
-from db import get_session
-from models import School, Staff, Facility, Incident, Program
-from sqlalchemy import select, func, text
+from db import Session, get_session
+from models import COUNTY_KEYS, School, Staff, Facility, Incident, Program
+from sqlalchemy import JSON, bindparam, cast, select, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import DataError, InternalError
 from services.analytics import EducationAnalytics
+from services.clustering import lloyd
+from services.geodesy import haversine_m
+import numpy as np
 
 import requests
-from shapely.geometry import shape as shapely_shape
-from geoalchemy2 import WKTElement
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-import threading
 from datetime import datetime, timedelta
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from services.auth import AuthService
 from models import User
 import io
-import pandas as pd
 from flask import send_file
-from services.cache import make_cache_decorator
-
-# Simple Nominatim cache persisted to disk to reduce external calls
-CACHE_FILE = "nominatim_cache.json"
-nominatim_cache = {}
-cache_lock = threading.Lock()
-
-
-def load_cache():
-    global nominatim_cache
-    try:
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                nominatim_cache = json.load(f)
-        else:
-            nominatim_cache = {}
-    except Exception:
-        nominatim_cache = {}
-
-
-def save_cache():
-    try:
-        with cache_lock:
-            with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(nominatim_cache, f)
-    except Exception:
-        pass
-
-
-# load cache at startup
-load_cache()
+from services.cache import make_cache_decorator, cache_response, cache_json, invalidate, get_shared, set_shared, delete_shared
+from services import geocache
+from services.json_provider import ORJSONProvider
+import functools
+import gzip
+import hashlib
+import threading
+import time
+import orjson
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
+# Compress JSON/HTML responses; already-encoded responses (e.g. the pre-gzipped /schools) are left alone
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_LEVEL'] = 5
+app.config['COMPRESS_BR_LEVEL'] = 5
+# Streamed (generator) responses are sent as they are produced; compressing them
+# would make Flask-Compress buffer the whole body first
+app.config['COMPRESS_STREAMS'] = False
+Compress(app)
+# Behind nginx/Apache, hand static file bodies to the web server (X-Sendfile)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
 app.secret_key = os.environ.get('APP_SECRET', 'dev-secret')
 
+@app.teardown_appcontext
+def remove_session(exc=None):
+    # handlers share one request-scoped Session; return its connection to the pool
+    Session.remove()
+
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
 
 
-@login_manager.user_loader
-def load_user(user_id):
+# Authenticated requests rebuild the user from a small snapshot kept in the
+# shared cache instead of opening a session per request; login/logout drop it.
+# With REDIS_URL the snapshot (and its removal) is shared by all workers;
+# without it each worker keeps its own, so a role change or deactivation can
+# take up to USER_CACHE_TTL seconds to reach the other workers.
+USER_CACHE_TTL = 30
+USER_SNAPSHOT_COLUMNS = (User.id, User.username, User.full_name, User.email, User.role, User.active)
+
+
+def user_cache_key(user_id):
+    return f'user:{int(user_id)}'
+
+
+def fetch_user_snapshot(user_id):
     session = get_session()
     try:
-        return session.query(User).get(int(user_id))
+        row = session.execute(select(*USER_SNAPSHOT_COLUMNS).where(User.id == int(user_id))).first()
+        return dict(row._mapping) if row else None
     finally:
         session.close()
 
 
+@login_manager.user_loader
+def load_user(user_id):
+    key = user_cache_key(user_id)
+    cached = get_shared(key)
+    if cached is not None:
+        snapshot = orjson.loads(cached)
+    else:
+        snapshot = fetch_user_snapshot(user_id)
+        if snapshot is None:
+            return None
+        set_shared(key, orjson.dumps(snapshot), USER_CACHE_TTL)
+    # a new transient User per request, never shared between threads or attached to a session
+    return User(**snapshot)
+
+
+# Read endpoints are tagged with a cheap version of the schools table, so
+# clients revalidating unchanged data get a 304 without any query or encoding.
+# The version lives in the shared cache and /schools/add drops it there, so with
+# REDIS_URL every worker sees a write at once; without Redis each worker keeps
+# its own copy and may answer 304 with the old ETag for up to SCHOOLS_VERSION_TTL
+# seconds after another worker's insert.
+SCHOOLS_VERSION_KEY = 'schools:version'
+SCHOOLS_VERSION_TTL = 60
+SQL_SCHOOLS_VERSION = text(
+    "SELECT md5(count(*)::text || ':' || coalesce(max(updated_at)::text, '')) FROM schools"
+)
+
+
+def fetch_schools_version():
+    return Session().execute(SQL_SCHOOLS_VERSION).scalar()
+
+
+def schools_version():
+    cached = get_shared(SCHOOLS_VERSION_KEY)
+    if cached is not None:
+        return cached.decode()
+    version = fetch_schools_version()
+    set_shared(SCHOOLS_VERSION_KEY, version.encode(), SCHOOLS_VERSION_TTL)
+    return version
+
+
+def etag_matches(version):
+    # Flask-Compress appends ":<algorithm>" to the ETag of compressed responses
+    return any(tag.split(':', 1)[0] == version for tag in request.if_none_match.as_set(include_weak=True))
+
+
+def conditional_on_schools(view):
+    """Answer If-None-Match with 304 while the schools table is unchanged.
+
+    Without Redis the version is per worker, so other workers can keep
+    answering 304 for up to SCHOOLS_VERSION_TTL seconds after an insert.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = schools_version()
+        if etag_matches(version):
+            resp = Response(status=304)
+        else:
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+        resp.set_etag(version)
+        # no-cache: clients always revalidate, which is cheap thanks to the ETag
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    return wrapper
+
+
+# Fixed-shape SQL is parsed once at import; handlers only bind parameters.
+# distance_m is merged into properties server-side so rows keep the
+# (id, name, properties, geojson) shape that rows_to_features unpacks
+SQL_KNN = text(
+    "SELECT id, name, COALESCE(properties, '{}'::jsonb) || jsonb_build_object('distance_m', "
+    "ST_Distance(geog, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography)) AS properties, "
+    "ST_AsGeoJSON(geom)::json AS geojson "
+    "FROM schools "
+    "ORDER BY geom <-> ST_SetSRID(ST_MakePoint(:lon, :lat), 4326) "
+    "LIMIT :k"
+)
+SQL_HEATGRID_VIEW = text("""
+    SELECT ST_AsGeoJSON(ST_Transform(g3857, 4326))::json AS geom, cnt
+    FROM schools_grid_1000
+    ORDER BY cnt DESC
+    LIMIT 1000
+""")
+# precomputed 1 km cells: filter and sort only
+SQL_HEATGRID_VIEW_BBOX = text("""
+    SELECT ST_AsGeoJSON(ST_Transform(g3857, 4326))::json AS geom, cnt
+    FROM schools_grid_1000
+    WHERE g3857 && ST_Transform(ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326),3857)
+    ORDER BY cnt DESC
+    LIMIT 1000
+""")
+# Snap to 3857 grid, aggregate counts, then return geometries back in 4326
+SQL_HEATGRID_NOBBOX = text("""
+    SELECT ST_AsGeoJSON(ST_Transform(ST_SnapToGrid(ST_Transform(geom,3857), :size, :size), 4326))::json AS geom, COUNT(*) as cnt
+    FROM schools
+    GROUP BY 1
+    ORDER BY cnt DESC
+    LIMIT 1000
+""")
+# filter in 4326 so the GIST index on geom applies
+SQL_HEATGRID_BBOX = text("""
+    SELECT ST_AsGeoJSON(ST_Transform(ST_SnapToGrid(ST_Transform(geom,3857), :size, :size), 4326))::json AS geom, COUNT(*) as cnt
+    FROM schools
+    WHERE geom && ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326)
+    GROUP BY 1
+    ORDER BY cnt DESC
+    LIMIT 1000
+""")
+# cluster where the data lives; only K rows come back
+SQL_CLUSTER_KMEANS = text(
+    "SELECT cid, AVG(ST_Y(c)) AS lat, AVG(ST_X(c)) AS lon, COUNT(*) AS n "
+    "FROM (SELECT ST_ClusterKMeans(geom, :k) OVER () AS cid, ST_Centroid(geom) AS c "
+    "FROM schools WHERE geom IS NOT NULL) sub GROUP BY cid ORDER BY cid"
+)
+SQL_CENTROIDS = text(
+    "SELECT ST_Y(c)::float8 AS lat, ST_X(c)::float8 AS lon "
+    "FROM (SELECT ST_Centroid(geom) AS c FROM schools WHERE geom IS NOT NULL) sub"
+)
+SQL_NEAREST = text(
+    "SELECT id, name, COALESCE(properties, '{}'::jsonb) || jsonb_build_object('distance_m', distance_m) AS properties, geojson "
+    "FROM (SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson, "
+    "ST_Distance(geog, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) AS distance_m "
+    "FROM schools ORDER BY distance_m LIMIT :k) nearest "
+    "ORDER BY distance_m"
+)
+# the summary view's extent lets the GIST index prune other counties;
+# schools without a county are grouped under 'UNKNOWN'
+SQL_SCHOOLS_BY_COUNTY = text(
+    "SELECT s.id, s.name, s.properties, ST_AsGeoJSON(s.geom)::json AS geojson "
+    "FROM schools s JOIN schools_summary ss ON ss.county = :county "
+    "WHERE s.geom && ss.bbox "
+    "AND (s.county = :county OR (s.county IS NULL AND :county = 'UNKNOWN'))"
+)
+# Use ST_DWithin on the geography column to calculate great-circle distances
+SQL_BUFFER = text(
+    "SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson"
+    " FROM schools"
+    " WHERE ST_DWithin(geog, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography, :radius)"
+    " LIMIT :k"
+)
+SQL_WITHIN = text(
+    "SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson "
+    "FROM schools "
+    "WHERE ST_Intersects(geom, ST_SetSRID(ST_GeomFromGeoJSON(:geom), 4326))"
+)
+SQL_HULL = text(
+    "SELECT ST_AsGeoJSON(ST_ConvexHull(ST_Collect(geom)))::json as geojson FROM schools"
+)
+SQL_STATS_DETAILS = text(
+    "SELECT county AS key, n AS cnt, ST_XMin(bbox) AS minx, ST_YMin(bbox) AS miny, "
+    "ST_XMax(bbox) AS maxx, ST_YMax(bbox) AS maxy "
+    "FROM schools_summary ORDER BY cnt DESC"
+)
+SQL_REFRESH_SUMMARY = text("REFRESH MATERIALIZED VIEW CONCURRENTLY schools_summary")
+SQL_REFRESH_RESOURCE_STATS = text("REFRESH MATERIALIZED VIEW CONCURRENTLY school_resource_stats")
+SQL_VORONOI_POINTS = text("SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson FROM schools")
+SQL_VORONOI_CELLS = text("""
+    WITH
+    bounds AS (
+        SELECT ST_Envelope(ST_Collect(geom)) AS env,
+               ST_Buffer(ST_Envelope(ST_Collect(geom))::geography, :radius_m)::geometry AS buf_env
+        FROM schools
+    ),
+    points AS (
+        SELECT geom FROM schools
+    ),
+    voronoi AS (
+        SELECT (ST_Dump(ST_VoronoiPolygons(ST_Collect(points.geom)))).geom AS cell
+        FROM points, bounds
+        WHERE ST_Intersects(bounds.env, points.geom)
+    )
+    SELECT ST_AsGeoJSON(ST_Intersection(
+        cell,
+        (SELECT buf_env FROM bounds)
+    ))::json AS geojson
+    FROM voronoi;
+""")
+SQL_VORONOI_BUFFER = text("""
+    SELECT ST_AsGeoJSON(
+        ST_Buffer(
+            ST_Collect(geom)::geography,
+            :radius_m
+        )::geometry
+    )::json AS geojson
+    FROM schools
+""")
+# indexes the spatial endpoints depend on; reported by /health
+REQUIRED_INDEXES = ('schools_geom_gist', 'idx_schools_geog_gist', 'schools_name_norm_trgm')
+SQL_HEALTH_INDEXES = text(
+    "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND indexname = ANY(:names)"
+)
+SQL_TILE = text(
+    "WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS env) "
+    "SELECT ST_AsMVT(t, 'schools', 4096, 'geom') FROM ("
+    "  SELECT id, name, properties,"
+    "         ST_AsMVTGeom(ST_Transform(geom, 3857), bounds.env, 4096, 64, true) AS geom"
+    "  FROM schools, bounds"
+    "  WHERE geom && ST_Transform(bounds.env, 4326)"
+    ") t"
+)
+
+
 @app.route('/schools/knn')
+@conditional_on_schools
 def schools_knn():
     """Fast nearest neighbors using PostGIS KNN (<->) operator and GiST index.
     Query params: lon, lat, k
@@ -90,29 +307,38 @@ def schools_knn():
     except Exception:
         return jsonify({'error': 'Invalid coordinates'}), 400
 
-    sql = text(
-        "SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson, "
-        "ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) AS distance_m "
-        "FROM schools "
-        "ORDER BY geom <-> ST_SetSRID(ST_MakePoint(:lon, :lat), 4326) "
-        "LIMIT :k"
-    )
-    session = get_session()
-    try:
-        rows = session.execute(sql.bindparams(lon=lon_f, lat=lat_f, k=k)).mappings().all()
-        features = []
-        for r in rows:
-            props = r.get('properties') or {}
-            if r.get('name') and not props.get('name'):
-                props['name'] = r.get('name')
-            props['distance_m'] = float(r.get('distance_m') or 0)
-            features.append({ 'type':'Feature', 'properties': props, 'geometry': r.get('geojson'), 'id': r.get('id') })
-        return jsonify({ 'type':'FeatureCollection', 'features': features })
-    finally:
-        session.close()
+    session = Session()
+    rows = session.execute(SQL_KNN, {'lon': lon_f, 'lat': lat_f, 'k': k}).all()
+    return jsonify({ 'type':'FeatureCollection', 'features': rows_to_features(rows) })
+
+
+HEATGRID_CACHE_TTL = 300
+# grid size precomputed in the schools_grid_1000 materialized view
+HEATGRID_VIEW_SIZE = 1000.0
+
+
+@make_cache_decorator(ttl=HEATGRID_CACHE_TTL)
+def heatgrid_features(grid_size, bbox):
+    """Grid cells with counts for one (grid_size, bbox) pair; cached per pair."""
+    params = dict(zip(('minx', 'miny', 'maxx', 'maxy'), bbox)) if bbox else {}
+    if grid_size == HEATGRID_VIEW_SIZE:
+        sql = SQL_HEATGRID_VIEW_BBOX if bbox else SQL_HEATGRID_VIEW
+    else:
+        sql = SQL_HEATGRID_BBOX if bbox else SQL_HEATGRID_NOBBOX
+        params['size'] = grid_size
+
+    session = Session()
+    rows = session.execute(sql, params).mappings().all()
+    features = []
+    for r in rows:
+        if r.get('geom') is None:
+            continue
+        features.append({'type':'Feature', 'properties': {'count': int(r.get('cnt') or 0)}, 'geometry': r.get('geom')})
+    return features
 
 
 @app.route('/schools/heatgrid')
+@conditional_on_schools
 def schools_heatgrid():
     """Return aggregated grid cells (in meters) with counts for heatmap visualization.
     Params: grid_size (meters, default=1000), bbox (minx,miny,maxx,maxy optional)
@@ -123,171 +349,203 @@ def schools_heatgrid():
         grid_size = 1000.0
 
     bbox = request.args.get('bbox')
-    session = get_session()
+    if bbox:
+        try:
+            minx, miny, maxx, maxy = [float(x) for x in bbox.split(',')]
+            bbox = (minx, miny, maxx, maxy)
+        except Exception:
+            return jsonify({'error':'Invalid bbox'}), 400
+
+    return jsonify({'type':'FeatureCollection', 'features': heatgrid_features(grid_size, bbox)})
+
+
+# Upper bound on ?k=; each distinct k is its own cache entry and clustering run
+MAX_CLUSTERS = 200
+
+
+@make_cache_decorator(ttl=30)
+def cluster_features(k):
+    """K-means cluster centroids with member counts; cached per k."""
+    session = Session()
     try:
-        params = {'size': grid_size}
-        bbox_filter = ''
-        if bbox:
-            try:
-                minx, miny, maxx, maxy = [float(x) for x in bbox.split(',')]
-                # transform bbox to 3857 to compare in meters
-                bbox_filter = "WHERE ST_Intersects(geom, ST_Transform(ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326),3857))"
-                params.update({'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy})
-            except Exception:
-                return jsonify({'error':'Invalid bbox'}), 400
-
-        # Snap to 3857 grid, aggregate counts, then return geometries back in 4326
-        sql = text(f"""
-            SELECT ST_AsGeoJSON(ST_Transform(ST_SnapToGrid(ST_Transform(geom,3857), :size, :size), 4326))::json AS geom, COUNT(*) as cnt
-            FROM schools
-            {bbox_filter}
-            GROUP BY 1
-            ORDER BY cnt DESC
-            LIMIT 1000
-        """
-        )
-        rows = session.execute(sql, params).mappings().all()
-        features = []
-        for r in rows:
-            if r.get('geom') is None:
-                continue
-            features.append({'type':'Feature', 'properties': {'count': int(r.get('cnt') or 0)}, 'geometry': r.get('geom')})
-        return jsonify({'type':'FeatureCollection', 'features': features})
-    finally:
-        session.close()
+        rows = session.execute(SQL_CLUSTER_KMEANS, {'k': k}).all()
+        centroids = [(float(r.lat), float(r.lon)) for r in rows]
+        counts = [int(r.n) for r in rows]
+    except Exception as e:
+        # e.g. k larger than the row count, or PostGIS without ST_ClusterKMeans
+        print(f"Warning: ST_ClusterKMeans failed, clustering in NumPy: {e}")
+        session.rollback()
+        rows = session.execute(SQL_CENTROIDS).fetchall()
+        if not rows:
+            return []
+
+        # (lat, lon) pairs straight from the driver's float tuples into an (N, 2) array
+        pts = np.fromiter((v for r in rows for v in r), dtype=np.float64, count=2 * len(rows)).reshape(-1, 2)
+        # vectorized Lloyd iterations (NumPy)
+        centroids, counts = lloyd(pts, k, iters=10)
+
+    # produce GeoJSON points for centroids with size
+    features = []
+    for i, c in enumerate(centroids):
+        features.append({'type':'Feature', 'properties':{'cluster': i, 'count': int(counts[i])}, 'geometry': {'type':'Point','coordinates':[float(c[1]), float(c[0])]}})
+    return features
 
 
 @app.route('/schools/cluster')
-@make_cache_decorator(ttl=30)
+@conditional_on_schools
 def schools_cluster():
-    """Return simple k-means clusters computed in Python from school centroids.
+    """Return k-means clusters of school centroids, computed by PostGIS ST_ClusterKMeans.
     Params: k (clusters, default 10)
-    This is a fallback clustering endpoint for quick visual grouping.
+    Falls back to NumPy clustering when the database cannot run ST_ClusterKMeans.
     """
     try:
         k = int(request.args.get('k', 10))
     except Exception:
         k = 10
+    k = min(max(1, k), MAX_CLUSTERS)
 
-    session = get_session()
+    return jsonify({'type':'FeatureCollection', 'features': cluster_features(k)})
+
+
+@app.route('/health')
+def health():
+    """Report database reachability and whether the required indexes exist."""
     try:
-        rows = session.execute(text("SELECT id, ST_X(ST_Centroid(geom)) AS lon, ST_Y(ST_Centroid(geom)) AS lat FROM schools")).mappings().all()
-        points = [(float(r['lat']), float(r['lon']), int(r['id'])) for r in rows if r['lon'] is not None and r['lat'] is not None]
-        if not points:
-            return jsonify({'type':'FeatureCollection', 'features': []})
-
-        # simple kmeans via scikit-like implementation without dependency
-        # initialize centroids by sampling
-        import random
-        centroids = [ (random.choice(points)[0], random.choice(points)[1]) for _ in range(min(k, len(points))) ]
-
-        def assign(p, cents):
-            best = 0; bestd = None
-            for i,c in enumerate(cents):
-                d = (p[0]-c[0])**2 + (p[1]-c[1])**2
-                if bestd is None or d < bestd:
-                    bestd = d; best = i
-            return best
-
-        for _ in range(10):
-            clusters = {i: [] for i in range(len(centroids))}
-            for p in points:
-                idx = assign(p, centroids)
-                clusters[idx].append(p)
-            newc = []
-            for i in range(len(centroids)):
-                pts = clusters[i]
-                if pts:
-                    avg_lat = sum([pt[0] for pt in pts])/len(pts)
-                    avg_lon = sum([pt[1] for pt in pts])/len(pts)
-                    newc.append((avg_lat, avg_lon))
-                else:
-                    newc.append(centroids[i])
-            centroids = newc
-
-        # produce GeoJSON points for centroids with size
-        features = []
-        for i,c in enumerate(centroids):
-            count = len(clusters.get(i, []))
-            features.append({'type':'Feature', 'properties':{'cluster': i, 'count': count}, 'geometry': {'type':'Point','coordinates':[c[1], c[0]]}})
-
-        return jsonify({'type':'FeatureCollection', 'features': features})
-    finally:
-        session.close()
+        found = set(Session().execute(SQL_HEALTH_INDEXES, {'names': list(REQUIRED_INDEXES)}).scalars())
+    except Exception as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 503
+    missing = [name for name in REQUIRED_INDEXES if name not in found]
+    return jsonify({'status': 'degraded' if missing else 'ok', 'missing_indexes': missing}), 200
 
 
-@app.route('/')
-def index():
-    # pass map center and zoom as template variables
-    center = [-1.286389, 36.817223]
-    zoom = 7
-    # detect if local vendored leaflet.draw exists and load integrity info if present
+MAP_CENTER = [-1.286389, 36.817223]
+MAP_ZOOM = 7
+# The static pages only vary on deploy, so their rendered HTML is cached
+PAGE_CACHE_TTL = 600
+
+
+def detect_leaflet_draw_vendor():
+    """Detect a vendored leaflet.draw and load its integrity info, once at import."""
     static_vendor_path = os.path.join(app.static_folder or 'static', 'vendor', 'leaflet-draw')
-    use_local_leaflet_draw = os.path.exists(os.path.join(static_vendor_path, 'leaflet.draw.js'))
-    leaflet_draw_integrity = {}
+    use_local = os.path.exists(os.path.join(static_vendor_path, 'leaflet.draw.js'))
+    integrity = {}
     try:
         integ_path = os.path.join(static_vendor_path, 'integrity.json')
         if os.path.exists(integ_path):
             with open(integ_path, 'r', encoding='utf-8') as f:
-                leaflet_draw_integrity = json.load(f)
+                integrity = json.load(f)
     except Exception:
-        leaflet_draw_integrity = {}
+        integrity = {}
+    return use_local, integrity
+
+
+USE_LOCAL_LEAFLET_DRAW, LEAFLET_DRAW_INTEGRITY = detect_leaflet_draw_vendor()
+
 
-    return render_template('index.html', center=center, zoom=zoom, use_local_leaflet_draw=use_local_leaflet_draw, leaflet_draw_integrity=leaflet_draw_integrity)
+@app.route('/')
+@make_cache_decorator(ttl=PAGE_CACHE_TTL)
+def index():
+    return render_template('index.html', center=MAP_CENTER, zoom=MAP_ZOOM, use_local_leaflet_draw=USE_LOCAL_LEAFLET_DRAW, leaflet_draw_integrity=LEAFLET_DRAW_INTEGRITY)
 
 
 @app.route('/nearest')
+@make_cache_decorator(ttl=PAGE_CACHE_TTL)
 def page_nearest():
-    center = [-1.286389, 36.817223]
-    zoom = 7
-    return render_template('nearest.html', center=center, zoom=zoom)
+    return render_template('nearest.html', center=MAP_CENTER, zoom=MAP_ZOOM)
 
 
 @app.route('/buffer')
+@make_cache_decorator(ttl=PAGE_CACHE_TTL)
 def page_buffer():
-    center = [-1.286389, 36.817223]
-    zoom = 7
-    return render_template('buffer.html', center=center, zoom=zoom)
+    return render_template('buffer.html', center=MAP_CENTER, zoom=MAP_ZOOM)
 
 
 @app.route('/map-stats')
+@make_cache_decorator(ttl=PAGE_CACHE_TTL)
 def page_stats():
-    center = [-1.286389, 36.817223]
-    zoom = 7
-    return render_template('stats.html', center=center, zoom=zoom)
+    return render_template('stats.html', center=MAP_CENTER, zoom=MAP_ZOOM)
 
 
-def row_to_feature(row):
-    # row: (id, name, properties, geojson)
-    geom_json = row.geojson
-    geometry = None
-    if geom_json:
-        try:
-            geometry = json.loads(geom_json)
-        except Exception:
-            geometry = None
+def geojson_fragment(geojson):
+    # ST_AsGeoJSON text is already valid JSON: embed it verbatim instead of
+    # casting to json in SQL, decoding to dicts and re-encoding
+    return orjson.Fragment(geojson) if geojson is not None else None
 
-    props = row.properties or {}
-    # ensure name present
-    if row.name and not props.get('name'):
-        props['name'] = row.name
 
-    return {
-        "type": "Feature",
-        "properties": props,
-        "geometry": geometry,
-        "id": row.id,
-    }
+def rows_to_features(rows):
+    """Turn (id, name, properties, geojson) rows into GeoJSON features.
+
+    geojson is cast to json in SQL, so the driver already hands back dicts.
+    The loop unpacks plain tuples and binds append locally, since it runs
+    once per row on the largest responses.
+    """
+    features = []
+    append = features.append
+    for rid, name, props, geometry in rows:
+        props = props or {}
+        # ensure name present
+        if name and not props.get('name'):
+            props['name'] = name
+        append({"type": "Feature", "properties": props, "geometry": geometry, "id": rid})
+    return features
+
+
+# The unfiltered /schools payload is serialized once and served from memory
+SCHOOLS_CACHE_KEY = 'schools:all'
+SCHOOLS_CACHE_TTL = 300
+
+
+def build_schools_payload():
+    """Serialize every school once; returns (body, gzipped body)."""
+    session = Session()
+    stmt = select(
+        School.id,
+        School.name,
+        School.properties,
+        cast(func.ST_AsGeoJSON(School.geom), JSON).label('geojson'),
+    )
+    rows = session.execute(stmt, execution_options={'yield_per': 1000})
+    features = rows_to_features(rows)
+    body = orjson.dumps({"type": "FeatureCollection", "features": features})
+    return body, gzip.compress(body, 6)
+
+
+def cached_schools_response():
+    """Serve the precomputed FeatureCollection, gzipped when accepted.
+
+    ETag/If-None-Match are handled by conditional_on_schools on the route.
+    """
+    body, body_gz = cache_response(SCHOOLS_CACHE_KEY, SCHOOLS_CACHE_TTL, build_schools_payload)
+    headers = {'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        resp = Response(body_gz, mimetype='application/json', headers=headers)
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = Response(body, mimetype='application/json', headers=headers)
+    return resp
 
 
 @app.route('/schools')
+@conditional_on_schools
 def get_schools():
     """Return GeoJSON FeatureCollection from the PostGIS `schools` table.
 
     Query parameters (optional):
       bbox=minx,miny,maxx,maxy   -- returns features intersecting this bbox
       lon & lat & k              -- returns nearest k features to this point
+      county=<name>              -- returns features of one county/admin area
+
+    Without parameters the whole table is served from a cached, pre-serialized
+    payload. Filtered responses are streamed feature by feature from a
+    server-side cursor so memory stays flat regardless of how many rows match.
     """
+    if not (request.args.get('lon') and request.args.get('lat')) and not request.args.get('bbox') \
+            and not request.args.get('county'):
+        try:
+            return cached_schools_response()
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
     session = get_session()
     try:
         # Nearest search if lat/lon provided
@@ -296,8 +554,7 @@ def get_schools():
         k = int(request.args.get('k') or 5)
 
         bbox = request.args.get('bbox')
-
-        geo_col = School.__table__.c.geom
+        county = request.args.get('county')
 
         if lon and lat:
             # nearest by great-circle distance (meters) using geography
@@ -305,23 +562,17 @@ def get_schools():
                 lon_f = float(lon)
                 lat_f = float(lat)
             except ValueError:
+                session.close()
                 return jsonify({"error": "Invalid lat/lon"}), 400
 
-            sql = text(
-                "SELECT id, name, properties, ST_AsGeoJSON(geom) AS geojson, "
-                "ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) AS distance_m "
-                "FROM schools "
-                "ORDER BY distance_m "
-                "LIMIT :k"
-            )
-
-            rows = session.execute(sql.bindparams(lon=lon_f, lat=lat_f, k=k)).all()
+            stmt = SQL_NEAREST.bindparams(lon=lon_f, lat=lat_f, k=k)
 
         elif bbox:
             # bbox: minx,miny,maxx,maxy
             try:
                 minx, miny, maxx, maxy = [float(x) for x in bbox.split(',')]
             except Exception:
+                session.close()
                 return jsonify({"error": "Invalid bbox format. Use minx,miny,maxx,maxy"}), 400
 
             envelope = func.ST_MakeEnvelope(minx, miny, maxx, maxy, 4326)
@@ -329,109 +580,98 @@ def get_schools():
                 School.id,
                 School.name,
                 School.properties,
-                func.ST_AsGeoJSON(School.geom).label('geojson'),
+                cast(func.ST_AsGeoJSON(School.geom), JSON).label('geojson'),
             ).where(func.ST_Intersects(School.geom, envelope))
 
-            rows = session.execute(stmt).all()
-
         else:
-            # return all
-            stmt = select(
-                School.id,
-                School.name,
-                School.properties,
-                func.ST_AsGeoJSON(School.geom).label('geojson'),
-            )
-            rows = session.execute(stmt).all()
-
-        features = []
-        for r in rows:
-            f = row_to_feature(r)
-            # attach distance if present (nearest query)
-            if hasattr(r, 'distance_m') and r.distance_m is not None:
-                if 'properties' not in f or f['properties'] is None:
-                    f['properties'] = {}
-                f['properties']['distance_m'] = float(r.distance_m)
-            features.append(f)
-
-        return jsonify({"type": "FeatureCollection", "features": features})
+            stmt = SQL_SCHOOLS_BY_COUNTY.bindparams(county=county)
+
+        rows = session.execute(stmt, execution_options={'yield_per': 1000})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
         session.close()
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        try:
+            yield b'{"type": "FeatureCollection", "features": ['
+            sep = b''
+            dumps = orjson.dumps
+            for partition in rows.partitions():
+                # one chunk per fetched batch rather than one per feature
+                yield sep + b','.join([dumps(f) for f in rows_to_features(partition)])
+                sep = b','
+            yield b']}'
+        finally:
+            session.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+SOURCE_GEOJSON = os.path.join(app.root_path, 'data', 'sec.geojson')
+
+
+@app.route('/data/schools.geojson')
+def schools_source_geojson():
+    """Serve the raw source GeoJSON file without parsing it.
+
+    send_file streams the file (sendfile(2) / X-Sendfile where available) and
+    supports ETag, Last-Modified and Range requests.
+    """
+    return send_file(SOURCE_GEOJSON, mimetype='application/geo+json', conditional=True, etag=True, max_age=3600)
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.mvt')
+@conditional_on_schools
+def schools_tile(z: int, x: int, y: int):
+    """Return a Mapbox vector tile with the schools inside tile z/x/y.
+
+    Clipping and encoding run in PostGIS, so only the features of one tile
+    ever leave the database.
+    """
+    if z < 0 or z > 30 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Invalid tile coordinates"}), 400
+
+    session = Session()
+    tile = session.execute(SQL_TILE, {'z': z, 'x': x, 'y': y}).scalar()
+    return Response(bytes(tile or b''), mimetype='application/vnd.mapbox-vector-tile')
 
 
 @app.route('/schools/stats')
+@conditional_on_schools
 def schools_stats():
     """Return simple spatial stats: count and extent."""
-    session = get_session()
-    try:
-        count = session.execute(select(func.count()).select_from(School)).scalar_one()
-        extent = session.execute(select(func.ST_Extent(School.geom))).scalar()
-        return jsonify({"count": count, "extent": extent})
-    finally:
-        session.close()
+    session = Session()
+    count = session.execute(select(func.count()).select_from(School)).scalar_one()
+    extent = session.execute(select(func.ST_Extent(School.geom))).scalar()
+    return jsonify({"count": count, "extent": extent})
 
 
 
 @app.route('/schools/buffer')
+@conditional_on_schools
 def schools_buffer():
     """Return features within a radius (in km) of a point.
 
     Query params: lon, lat, radius_km, optional limit k
     """
-    session = get_session()
-    try:
-        lon = request.args.get('lon')
-        lat = request.args.get('lat')
-        radius_km = request.args.get('radius_km')
-        k = int(request.args.get('k') or 1000)
-
-        if not lon or not lat or not radius_km:
-            return jsonify({"error": "Provide lon, lat and radius_km"}), 400
+    session = Session()
+    lon = request.args.get('lon')
+    lat = request.args.get('lat')
+    radius_km = request.args.get('radius_km')
+    k = int(request.args.get('k') or 1000)
 
-        try:
-            lon_f = float(lon)
-            lat_f = float(lat)
-            radius_m = float(radius_km) * 1000.0
-        except ValueError:
-            return jsonify({"error": "Invalid numeric parameters"}), 400
-
-        # Use ST_DWithin with geography cast to calculate great-circle distances
-        sql = text(
-            "SELECT id, name, properties, ST_AsGeoJSON(geom) AS geojson"
-            " FROM schools"
-            " WHERE ST_DWithin(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography, :radius)"
-            " LIMIT :k"
-        )
-
-        rows = session.execute(sql.bindparams(lon=lon_f, lat=lat_f, radius=radius_m, k=k)).all()
-
-        # rows are Row objects with keys id,name,properties,geojson
-        features = []
-        for r in rows:
-            geom_json = r.geojson
-            geometry = None
-            if geom_json:
-                try:
-                    geometry = json.loads(geom_json)
-                except Exception:
-                    geometry = None
-
-            props = r.properties or {}
-            if r.name and not props.get('name'):
-                props['name'] = r.name
+    if not lon or not lat or not radius_km:
+        return jsonify({"error": "Provide lon, lat and radius_km"}), 400
 
-            features.append({
-                "type": "Feature",
-                "properties": props,
-                "geometry": geometry,
-                "id": r.id,
-            })
+    try:
+        lon_f = float(lon)
+        lat_f = float(lat)
+        radius_m = float(radius_km) * 1000.0
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameters"}), 400
 
-        return jsonify({"type": "FeatureCollection", "features": features})
-    finally:
-        session.close()
+    rows = session.execute(SQL_BUFFER, {'lon': lon_f, 'lat': lat_f, 'radius': radius_m, 'k': k}).all()
+    return jsonify({"type": "FeatureCollection", "features": rows_to_features(rows)})
 
 
 @app.route('/schools/within', methods=['POST'])
@@ -447,76 +687,87 @@ def schools_within():
     geom = data['geometry']
     geom_str = json.dumps(geom)
 
-    session = get_session()
-    try:
-        sql = text(
-            "SELECT id, name, properties, ST_AsGeoJSON(geom) AS geojson "
-            "FROM schools "
-            "WHERE ST_Intersects(geom, ST_SetSRID(ST_GeomFromGeoJSON(:geom), 4326))"
-        )
-        rows = session.execute(sql.bindparams(geom=geom_str)).all()
-
-        features = []
-        for r in rows:
-            geom_json = r.geojson
-            geometry = None
-            if geom_json:
-                try:
-                    geometry = json.loads(geom_json)
-                except Exception:
-                    geometry = None
-
-            props = r.properties or {}
-            if r.name and not props.get('name'):
-                props['name'] = r.name
-
-            features.append({
-                "type": "Feature",
-                "properties": props,
-                "geometry": geometry,
-                "id": r.id,
-            })
-
-        return jsonify({"type": "FeatureCollection", "features": features})
-    finally:
-        session.close()
+    session = Session()
+    rows = session.execute(SQL_WITHIN, {'geom': geom_str}).all()
+    return jsonify({"type": "FeatureCollection", "features": rows_to_features(rows)})
 
 
 @app.route('/schools/hull')
+@conditional_on_schools
 def schools_hull():
     """Return the convex hull polygon (GeoJSON) of all geometries in the table."""
-    session = get_session()
-    try:
-        row = session.execute(text(
-            "SELECT ST_AsGeoJSON(ST_ConvexHull(ST_Collect(geom))) as geojson FROM schools"
-        )).first()
-        if not row or not row.geojson:
-            return jsonify({"type": "FeatureCollection", "features": []})
-
-        geom = json.loads(row.geojson)
-        feature = {"type": "Feature", "properties": {}, "geometry": geom}
-        return jsonify({"type": "FeatureCollection", "features": [feature]})
-    finally:
-        session.close()
+    session = Session()
+    row = session.execute(SQL_HULL).first()
+    if not row or not row.geojson:
+        return jsonify({"type": "FeatureCollection", "features": []})
+
+    feature = {"type": "Feature", "properties": {}, "geometry": row.geojson}
+    return jsonify({"type": "FeatureCollection", "features": [feature]})
 
 
 @app.route('/schools/stats/details')
+@conditional_on_schools
 def schools_stats_details():
-    """Return counts grouped by administrative attribute (county/admin), if present."""
+    """Return counts and extents grouped by administrative attribute (county/admin), if present.
+
+    Reads the precomputed `schools_summary` materialized view.
+    """
+    session = Session()
+    rows = session.execute(SQL_STATS_DETAILS).all()
+    data = [{"key": r.key, "count": int(r.cnt), "bbox": [r.minx, r.miny, r.maxx, r.maxy]} for r in rows]
+    return jsonify(data)
+
+
+# Writes only mark the views stale; a background thread refreshes them once per
+# burst, REFRESH_DELAY seconds after the first write, off the request path
+REFRESH_DELAY = 30.0
+_refresh_pending = threading.Event()
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def refresh_views():
+    """Recompute `schools_summary` and `school_resource_stats`;
+    CONCURRENTLY keeps readers unblocked.
+    """
     session = get_session()
     try:
-        sql = text(
-            "SELECT COALESCE(properties->>'county', properties->>'COUNTY', properties->>'admin', properties->>'ADMIN', 'UNKNOWN') as key, "
-            "count(*) as cnt FROM schools GROUP BY key ORDER BY cnt DESC"
-        )
-        rows = session.execute(sql).all()
-        data = [{"key": r.key, "count": int(r.cnt)} for r in rows]
-        return jsonify(data)
+        for stmt in (SQL_REFRESH_SUMMARY, SQL_REFRESH_RESOURCE_STATS):
+            try:
+                # whole-table aggregates: not bound by the per-request limit
+                session.execute(text("SET LOCAL statement_timeout = 0"))
+                session.execute(stmt)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                print(f"Warning: could not refresh materialized view: {e}")
     finally:
         session.close()
 
 
+def _refresh_loop():
+    while True:
+        _refresh_pending.wait()
+        # let the rest of the burst land before recomputing
+        time.sleep(REFRESH_DELAY)
+        _refresh_pending.clear()
+        refresh_views()
+
+
+def schedule_view_refresh():
+    """Mark the materialized views stale; they are refreshed in the background."""
+    # started lazily so each forked worker gets its own thread
+    global _refresher
+    if _refresher is None or not _refresher.is_alive():
+        with _refresher_lock:
+            if _refresher is None or not _refresher.is_alive():
+                _refresher = threading.Thread(target=_refresh_loop, name='view-refresh', daemon=True)
+                _refresher.start()
+    _refresh_pending.set()
+
+
 @app.route('/schools/voronoi')
+@conditional_on_schools
 def schools_voronoi():
     """Generate Voronoi diagram showing school service areas.
     Optional params:
@@ -528,118 +779,90 @@ def schools_voronoi():
     except ValueError:
         return jsonify({"error": "Invalid radius"}), 400
 
-    session = get_session()
-    try:
-        # First get the points
-        points_sql = text("SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson FROM schools")
-        points = session.execute(points_sql).mappings().all()
-        point_features = []
-        for p in points:
-            props = p['properties'] or {}
-            if p['name'] and not props.get('name'):
-                props['name'] = p['name']
-            point_features.append({
-                "type": "Feature",
-                "properties": props,
-                "geometry": p['geojson'],
-                "id": p['id']
-            })
+    session = Session()
+    # First get the points
+    points = session.execute(SQL_VORONOI_POINTS).mappings().all()
+    point_features = []
+    for p in points:
+        props = p['properties'] or {}
+        if p['name'] and not props.get('name'):
+            props['name'] = p['name']
+        point_features.append({
+            "type": "Feature",
+            "properties": props,
+            "geometry": p['geojson'],
+            "id": p['id']
+        })
 
-        # Generate Voronoi diagram
-        voronoi_sql = text("""
-            WITH
-            bounds AS (
-                SELECT ST_Envelope(ST_Collect(geom)) AS env,
-                       ST_Buffer(ST_Envelope(ST_Collect(geom))::geography, :radius_m)::geometry AS buf_env
-                FROM schools
-            ),
-            points AS (
-                SELECT geom FROM schools
-            ),
-            voronoi AS (
-                SELECT (ST_Dump(ST_VoronoiPolygons(ST_Collect(points.geom)))).geom AS cell
-                FROM points, bounds
-                WHERE ST_Intersects(bounds.env, points.geom)
-            )
-            SELECT ST_AsGeoJSON(ST_Intersection(
-                cell,
-                (SELECT buf_env FROM bounds)
-            ))::json AS geojson
-            FROM voronoi;
-        """)
-        voronoi_rows = session.execute(voronoi_sql, {"radius_m": radius_km * 1000}).mappings().all()
-        voronoi_features = []
-        for r in voronoi_rows:
-            if r['geojson']:
-                voronoi_features.append({
-                    "type": "Feature",
-                    "properties": {},
-                    "geometry": r['geojson']
-                })
-
-        # Generate buffer
-        buffer_sql = text("""
-            SELECT ST_AsGeoJSON(
-                ST_Buffer(
-                    ST_Collect(geom)::geography,
-                    :radius_m
-                )::geometry
-            )::json AS geojson
-            FROM schools
-        """)
-        buffer = session.execute(buffer_sql, {"radius_m": radius_km * 1000}).scalar()
-
-        return jsonify({
-            "voronoi": {
-                "type": "FeatureCollection",
-                "features": voronoi_features
-            },
-            "buffer": {
+    # Generate Voronoi diagram
+    voronoi_rows = session.execute(SQL_VORONOI_CELLS, {"radius_m": radius_km * 1000}).mappings().all()
+    voronoi_features = []
+    for r in voronoi_rows:
+        if r['geojson']:
+            voronoi_features.append({
                 "type": "Feature",
                 "properties": {},
-                "geometry": buffer
-            } if buffer else None,
-            "points": {
-                "type": "FeatureCollection",
-                "features": point_features
-            }
-        })
-    finally:
-        session.close()
+                "geometry": r['geojson']
+            })
+
+    # Generate buffer
+    buffer = session.execute(SQL_VORONOI_BUFFER, {"radius_m": radius_km * 1000}).scalar()
+
+    return jsonify({
+        "voronoi": {
+            "type": "FeatureCollection",
+            "features": voronoi_features
+        },
+        "buffer": {
+            "type": "Feature",
+            "properties": {},
+            "geometry": buffer
+        } if buffer else None,
+        "points": {
+            "type": "FeatureCollection",
+            "features": point_features
+        }
+    })
+
+
+# Analytics figures are whole-table aggregates; serve them from cache briefly
+ANALYTICS_CACHE_TTL = 60
+
+
+def analysis_stats():
+    analytics = EducationAnalytics()
+    return {
+        "total_schools": Session().query(func.count(School.id)).scalar() or 0,
+        "total_enrollment": analytics.get_enrollment_statistics()['total_enrollment'],
+        "avg_performance": analytics.get_performance_metrics()['average_performance_index'],
+        "teacher_ratio": round(analytics.get_resource_distribution()['teacher_student_ratio'], 1)
+    }
 
 
 @app.route('/schools/analysis')
 def page_analysis():
     """Render the enhanced education analytics dashboard page."""
-    session = get_session()
-    try:
-        # Get initial statistics
-        analytics = EducationAnalytics()
-        stats = {
-            "total_schools": session.query(func.count(School.id)).scalar() or 0,
-            "total_enrollment": analytics.get_enrollment_statistics()['total_enrollment'],
-            "avg_performance": analytics.get_performance_metrics()['average_performance_index'],
-            "teacher_ratio": round(analytics.get_resource_distribution()['teacher_student_ratio'], 1)
-        }
-        
-        # Get counties and school types for filters
-        counties = session.query(School.county).distinct().all()
-        counties = sorted([c[0] for c in counties if c[0]])
-        
-        school_types = session.query(School.school_type).distinct().all()
-        school_types = sorted([t[0] for t in school_types if t[0]])
-        
-        center = [-1.286389, 36.817223]
-        zoom = 7
-        
-        return render_template('analysis.html', 
-                             center=center, 
-                             zoom=zoom,
-                             stats=stats,
-                             counties=counties,
-                             school_types=school_types)
-    finally:
-        session.close()
+    session = Session()
+    # Get initial statistics
+    # keyed on the schools version, so an insert is reflected on the next request
+    stats = cache_response('analysis:stats:' + schools_version(), ANALYTICS_CACHE_TTL, analysis_stats)
+    
+    # Get counties and school types for filters
+    counties = session.query(School.county).distinct().all()
+    counties = sorted([c[0] for c in counties if c[0]])
+    
+    school_types = session.query(School.school_type).distinct().all()
+    school_types = sorted([t[0] for t in school_types if t[0]])
+    
+    center = [-1.286389, 36.817223]
+    zoom = 7
+    
+    return render_template('analysis.html', 
+                         center=center, 
+                         zoom=zoom,
+                         stats=stats,
+                         counties=counties,
+                         school_types=school_types)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -649,20 +872,27 @@ def login():
 
     username = request.form.get('username')
     password = request.form.get('password')
-    session = get_session()
-    try:
-        user = session.query(User).filter(User.username == username).first()
-        if user and AuthService.verify_password(user, password):
-            login_user(user)
-            return json.dumps({'ok': True}), 200, {'ContentType': 'application/json'}
-        return json.dumps({'ok': False, 'error': 'Invalid credentials'}), 401, {'ContentType': 'application/json'}
-    finally:
-        session.close()
+    session = Session()
+    user = session.query(User).filter(User.username == username).first()
+    if user and AuthService.verify_password(user, password):
+        if AuthService.needs_rehash(user):
+            # upgrade legacy hashes while the plaintext is at hand
+            try:
+                user.password_hash = AuthService.hash_password(password)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                print(f"Warning: could not rehash password for user {user.id}: {e}")
+        delete_shared(user_cache_key(user.id))
+        login_user(user)
+        return json.dumps({'ok': True}), 200, {'ContentType': 'application/json'}
+    return json.dumps({'ok': False, 'error': 'Invalid credentials'}), 401, {'ContentType': 'application/json'}
 
 
 @app.route('/logout')
 @login_required
 def logout():
+    delete_shared(user_cache_key(current_user.get_id()))
     logout_user()
     return render_template('index.html', center=[-1.286389, 36.817223], zoom=7)
 
@@ -673,54 +903,62 @@ def admin_panel():
     # basic admin view: list users (admin role required)
     if not current_user.role or current_user.role != 'admin':
         return "Forbidden", 403
-    session = get_session()
-    try:
-        users = session.query(User).all()
-        return render_template('admin.html', users=users)
-    finally:
-        session.close()
+    session = Session()
+    users = session.query(User).all()
+    return render_template('admin.html', users=users)
+
+
+EXPORT_CSV_COPY = (
+    "COPY (SELECT id, name, county, school_type AS type, current_enrollment AS enrollment, "
+    "student_capacity AS capacity FROM schools) TO STDOUT WITH (FORMAT csv, HEADER)"
+)
 
 
 @app.route('/api/export/csv')
 @login_required
 def export_csv():
-    # export current schools dataset or filtered view
+    # PostgreSQL writes the CSV itself; chunks are relayed as they arrive
     session = get_session()
-    try:
-        rows = session.query(
-            School.id, School.name, School.county, School.school_type, School.current_enrollment, School.student_capacity
-        ).all()
-        df = pd.DataFrame([{
-            'id': r.id, 'name': r.name, 'county': r.county, 'type': r.school_type,
-            'enrollment': r.current_enrollment, 'capacity': r.student_capacity
-        } for r in rows])
-        buf = io.StringIO()
-        df.to_csv(buf, index=False)
-        buf.seek(0)
-        return send_file(io.BytesIO(buf.getvalue().encode('utf-8')), mimetype='text/csv', as_attachment=True, download_name='schools.csv')
-    finally:
-        session.close()
+
+    def generate():
+        try:
+            # a full-table export can outlast the per-statement limit set for requests
+            session.execute(text("SET LOCAL statement_timeout = 0"))
+            raw = session.connection().connection.driver_connection
+            with raw.cursor() as cur:
+                with cur.copy(EXPORT_CSV_COPY) as copy:
+                    for chunk in copy:
+                        yield bytes(chunk)
+        finally:
+            session.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=schools.csv'})
 
 
 @app.route('/api/export/excel')
 @login_required
 def export_excel():
-    session = get_session()
-    try:
-        rows = session.query(
-            School.id, School.name, School.county, School.school_type, School.current_enrollment, School.student_capacity
-        ).all()
-        df = pd.DataFrame([{
-            'id': r.id, 'name': r.name, 'county': r.county, 'type': r.school_type,
-            'enrollment': r.current_enrollment, 'capacity': r.student_capacity
-        } for r in rows])
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='schools')
-        buf.seek(0)
-        return send_file(buf, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name='schools.xlsx')
-    finally:
-        session.close()
+    import xlsxwriter
+
+    session = Session()
+    stmt = select(
+        School.id, School.name, School.county, School.school_type, School.current_enrollment, School.student_capacity
+    ).execution_options(yield_per=5000)
+    buf = io.BytesIO()
+    # constant_memory flushes each row as it is written instead of holding the sheet
+    workbook = xlsxwriter.Workbook(buf, {'constant_memory': True})
+    ws = workbook.add_worksheet('schools')
+    ws.write_row(0, 0, ['id', 'name', 'county', 'type', 'enrollment', 'capacity'])
+    for i, row in enumerate(session.execute(stmt), 1):
+        ws.write_row(i, 0, row)
+    workbook.close()
+    buf.seek(0)
+    return send_file(buf, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name='schools.xlsx')
+
+
+# Rows per PDF table; small tables keep reportlab's split/layout cost linear
+PDF_TABLE_ROWS = 500
 
 
 @app.route('/api/export/pdf')
@@ -728,121 +966,239 @@ def export_excel():
 def export_pdf():
     # create a simple PDF with a table of schools
     from reportlab.lib.pagesizes import letter
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+    from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle
     from reportlab.lib import colors
 
-    session = get_session()
-    try:
-        rows = session.query(School.id, School.name, School.county, School.current_enrollment).all()
-        data = [['ID', 'Name', 'County', 'Enrollment']] + [[r.id, r.name, r.county or '', r.current_enrollment or ''] for r in rows]
-        buf = io.BytesIO()
-        doc = SimpleDocTemplate(buf, pagesize=letter)
-        table = Table(data, repeatRows=1)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
-            ('ALIGN',(0,0),(-1,-1),'LEFT'),
-            ('GRID',(0,0),(-1,-1),0.5,colors.black)
-        ]))
-        doc.build([table])
-        buf.seek(0)
-        return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name='schools.pdf')
-    finally:
-        session.close()
+    header = ['ID', 'Name', 'County', 'Enrollment']
+    style = TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.grey),
+        ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
+        ('ALIGN',(0,0),(-1,-1),'LEFT'),
+        ('GRID',(0,0),(-1,-1),0.5,colors.black)
+    ])
+
+    session = Session()
+    stmt = select(School.id, School.name, School.county, School.current_enrollment).execution_options(yield_per=PDF_TABLE_ROWS)
+    tables = []
+    for partition in session.execute(stmt).partitions():
+        data = [header] + [[r.id, r.name, r.county or '', r.current_enrollment or ''] for r in partition]
+        table = LongTable(data, repeatRows=1)
+        table.setStyle(style)
+        tables.append(table)
+    if not tables:
+        tables.append(LongTable([header], repeatRows=1, style=style))
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=letter)
+    doc.build(tables)
+    buf.seek(0)
+    return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name='schools.pdf')
+
+
+# Every dashboard figure in one statement: PostgreSQL builds the whole JSON
+# document, so a load is a single round-trip with no Python-side assembly.
+DASHBOARD_SQL = text("""
+    WITH params AS (
+        SELECT CAST(:county AS text) AS county, CAST(:school_type AS text) AS school_type
+    ),
+    hist AS (
+        SELECT SUM(eh.enrollment) AS total
+        FROM enrollment_history eh JOIN schools s ON eh.school_id = s.id, params p
+        WHERE p.county IS NULL OR s.county = p.county
+    ),
+    cur AS (
+        SELECT COALESCE(SUM(s.current_enrollment), 0) AS total
+        FROM schools s, params p
+        WHERE p.county IS NULL OR s.county = p.county
+    ),
+    enrollment AS (
+        -- prefer enrollment_history totals where present
+        SELECT COALESCE(hist.total, cur.total)::bigint AS total FROM hist, cur
+    ),
+    perf AS (
+        SELECT COUNT(s.id) AS n, ROUND(COALESCE(AVG(s.performance_index), 0)::numeric, 2) AS avg_pi
+        FROM schools s, params p
+        WHERE p.school_type IS NULL OR s.school_type = p.school_type
+    ),
+    res AS (
+        SELECT ROUND(COALESCE(AVG(teacher_count), 0)::numeric, 2) AS teachers,
+               ROUND(COALESCE(AVG(classrooms), 0)::numeric, 2) AS classrooms,
+               ROUND(COALESCE(AVG(labs), 0)::numeric, 2) AS labs,
+               ROUND(COALESCE(AVG(libraries), 0)::numeric, 2) AS libraries,
+               ROUND(COALESCE(AVG(teacher_count * 1.0 / NULLIF(current_enrollment, 0)), 0)::numeric, 2) AS ratio
+        FROM schools
+    ),
+    map AS (
+        SELECT s.id, s.name, s.school_type, s.current_enrollment, s.mean_score,
+               ST_X(s.geom) AS lon, ST_Y(s.geom) AS lat  -- geom is stored in EPSG:4326
+        FROM schools s, params p
+        WHERE (p.county IS NULL OR s.county = p.county)
+          AND (p.school_type IS NULL OR s.school_type = p.school_type)
+    ),
+    type_counts AS (
+        SELECT school_type AS k, COUNT(*) AS n FROM schools GROUP BY 1
+    ),
+    fac_cond AS (
+        SELECT COALESCE(condition, 'Unknown') AS k, COUNT(*) AS n FROM facilities GROUP BY 1
+    ),
+    inc AS (
+        SELECT type, severity, status FROM incidents WHERE reported_at >= now() - interval '30 days'
+    ),
+    insp AS (
+        SELECT COUNT(*) AS n, ROUND(COALESCE(AVG(score), 0)::numeric, 2) AS avg_score
+        FROM inspection_history WHERE inspected_at >= now() - interval '30 days'
+    ),
+    staff_roles AS (
+        SELECT COALESCE(role, 'Unknown') AS k, COUNT(*) AS n FROM staff GROUP BY 1
+    ),
+    county_counts AS (
+        SELECT COALESCE(county, 'Unknown') AS k, COUNT(*) AS n FROM schools GROUP BY 1
+    )
+    SELECT jsonb_build_object(
+        'totalSchools', perf.n,
+        'totalStudents', enrollment.total,
+        'avgPerformance', perf.avg_pi,
+        'teacherRatio', res.ratio,
+        'schools', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'id', id, 'name', name, 'type', school_type, 'enrollment', current_enrollment,
+                'performance', mean_score, 'lon', lon, 'lat', lat))
+            FROM map), '[]'::jsonb),
+        -- placeholder trend until monthly enrollment history is available
+        'enrollmentTrends', jsonb_build_object(
+            'labels', to_jsonb(ARRAY['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']),
+            'values', (SELECT jsonb_agg(enrollment.total) FROM generate_series(1, 12))),
+        'schoolTypes', jsonb_build_object(
+            'labels', COALESCE((SELECT jsonb_agg(COALESCE(k, 'Unknown') ORDER BY k) FROM type_counts), '[]'::jsonb),
+            'values', COALESCE((SELECT jsonb_agg(n ORDER BY k) FROM type_counts), '[]'::jsonb)),
+        'resources', jsonb_build_object(
+            'teachers', res.teachers, 'classrooms', res.classrooms,
+            'labs', res.labs, 'libraries', res.libraries),
+        'facilities', jsonb_build_object(
+            'condition_summary', COALESCE((SELECT jsonb_object_agg(k, n) FROM fac_cond), '{}'::jsonb),
+            'maintenance_needed', (SELECT COUNT(*) FROM facilities
+                                   WHERE condition = 'Needs Repair' OR last_maintenance < now() - interval '365 days'),
+            'total_facilities', (SELECT COALESCE(SUM(n), 0) FROM fac_cond)),
+        'incidents', jsonb_build_object(
+            'by_type', COALESCE((SELECT jsonb_object_agg(k, n) FROM
+                (SELECT COALESCE(type, 'Unknown') AS k, COUNT(*) AS n FROM inc GROUP BY 1) t), '{}'::jsonb),
+            'by_severity', COALESCE((SELECT jsonb_object_agg(k, n) FROM
+                (SELECT COALESCE(severity, 'Unknown') AS k, COUNT(*) AS n FROM inc GROUP BY 1) t), '{}'::jsonb),
+            'open_incidents', (SELECT COUNT(*) FROM inc WHERE status <> 'Resolved'),
+            'total_incidents', (SELECT COUNT(*) FROM inc),
+            'recent_inspections_count', insp.n,
+            'recent_inspections_avg_score', insp.avg_score),
+        'staffing', jsonb_build_object(
+            'role_distribution', COALESCE((SELECT jsonb_object_agg(k, n) FROM staff_roles), '{}'::jsonb),
+            'total_staff', (SELECT COALESCE(SUM(n), 0) FROM staff_roles),
+            'qualified_staff', (SELECT COUNT(*) FROM staff WHERE qualifications @? '$.degree')),
+        'coverage', jsonb_build_object(
+            'average_distance_km', (SELECT ROUND((COALESCE(AVG(ST_Distance(
+                geog, ST_SetSRID(ST_MakePoint(36.817223, -1.286389), 4326)::geography)), 0) / 1000)::numeric, 2)
+                FROM schools),
+            'schools_per_county', COALESCE((SELECT jsonb_object_agg(k, n) FROM county_counts), '{}'::jsonb),
+            'total_counties', (SELECT COUNT(*) FROM county_counts))
+    )::text
+    FROM perf, enrollment, res, insp
+""")
+
 
 @app.route('/api/dashboard/data')
 def get_dashboard_data():
     """Provide data for the education analytics dashboard with optional filters."""
     county = request.args.get('county')
     school_type = request.args.get('school_type')
-    metric = request.args.get('metric', 'performance')
-    
-    analytics = EducationAnalytics()
-    
-    # Get basic statistics
-    enrollment_stats = analytics.get_enrollment_statistics(county)
-    performance_stats = analytics.get_performance_metrics(school_type)
-    resource_stats = analytics.get_resource_distribution()
-    facility_stats = analytics.get_facility_status()
-    incident_stats = analytics.get_incident_summary()
-    staff_stats = analytics.get_staff_qualifications()
-    coverage_stats = analytics.get_school_coverage_analysis()
-    
-    session = get_session()
-    try:
-        # Get schools for map visualization with filters
-        query = session.query(
-            School.id,
-            School.name,
-            School.school_type,
-            School.current_enrollment,
-            School.mean_score,
-            func.ST_X(func.ST_Transform(School.geom, 4326)).label('lon'),
-            func.ST_Y(func.ST_Transform(School.geom, 4326)).label('lat')
-        )
-        
-        if county:
-            query = query.filter(School.county == county)
-        if school_type:
-            query = query.filter(School.school_type == school_type)
-            
-        schools = [{
-            'id': s.id,
-            'name': s.name,
-            'type': s.school_type,
-            'enrollment': s.current_enrollment,
-            'performance': s.mean_score,
-            'lon': float(s.lon),
-            'lat': float(s.lat)
-        } for s in query.all()]
-        
-        # Get enrollment trends (last 12 months)
-        enrollment_trends = {
-            'labels': ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                      'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
-            'values': [enrollment_stats['total_enrollment']] * 12  # Placeholder, replace with actual historical data
-        }
-        
-        # Get school types distribution
-        school_types_stats = session.query(
-            School.school_type,
-            func.count(School.id)
-        ).group_by(School.school_type).all()
-        
-        school_types_data = {
-            'labels': [t[0] or 'Unknown' for t in school_types_stats],
-            'values': [int(t[1]) for t in school_types_stats]
-        }
-        
-        return jsonify({
-            'totalSchools': performance_stats['total_schools'],
-            'totalStudents': enrollment_stats['total_enrollment'],
-            'avgPerformance': performance_stats['average_performance_index'],
-            'teacherRatio': resource_stats['teacher_student_ratio'],
-            'schools': schools,
-            'enrollmentTrends': enrollment_trends,
-            'schoolTypes': school_types_data,
-            'resources': {
-                'teachers': resource_stats['average_teachers'],
-                'classrooms': resource_stats['average_classrooms'],
-                'labs': resource_stats['average_labs'],
-                'libraries': resource_stats['average_libraries']
-            },
-            'facilities': facility_stats,
-            'incidents': incident_stats,
-            'staffing': staff_stats,
-            'coverage': coverage_stats
-        })
-    finally:
-        session.close()
+
+    # keyed on the schools version (like the search cache), so inserts show up at once
+    body = cache_json(
+        'dashboard:' + repr((county, school_type, schools_version())), ANALYTICS_CACHE_TTL,
+        lambda: Session().execute(DASHBOARD_SQL, {'county': county, 'school_type': school_type}).scalar(),
+    )
+    return Response(body, mimetype='application/json')
 
 
 @app.route('/schools/coverage')
+@make_cache_decorator(ttl=PAGE_CACHE_TTL)
 def page_coverage():
     """Render the school coverage (Voronoi) analysis page."""
-    center = [-1.286389, 36.817223]
-    zoom = 7
-    return render_template('voronoi.html', center=center, zoom=zoom)
+    return render_template('voronoi.html', center=MAP_CENTER, zoom=MAP_ZOOM)
+
+
+# pg_trgm word_similarity cut-off for fuzzy name matches (server default 0.6)
+SEARCH_WORD_SIMILARITY = float(os.environ.get('SEARCH_WORD_SIMILARITY', 0.5))
+# At 5 x scale_m the distance term has decayed to 1/6 of its weight
+SEARCH_RADIUS_SCALES = 5
+# One pooled keep-alive session for Nominatim, so cache misses reuse an open
+# TLS connection instead of handshaking on every request
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'
+NOMINATIM_SESSION = requests.Session()
+NOMINATIM_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10, pool_maxsize=20, max_retries=Retry(total=2, backoff_factor=0.2)
+))
+NOMINATIM_SESSION.headers['User-Agent'] = 'flask-app-deploy/1.0 (example@example.com)'
+# Autocomplete repeats identical queries; whole responses are cached briefly.
+# The key includes the schools version, so an add is visible on the next call.
+SEARCH_CACHE_TTL = 60
+# rows fetched per round-trip from the server-side search cursor
+SEARCH_FETCH_ROWS = 100
+SEARCH_STREAM = {'yield_per': SEARCH_FETCH_ROWS}
+SQL_SEARCH_THRESHOLD = text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)")
+# Fuzzy: substring or trigram word-similarity match, both served by the GIN
+# index. Prefix (autocomplete): a plain LIKE 'term%' that the text_pattern_ops
+# B-tree answers with a range scan, no trigram work at all.
+SEARCH_MATCH = {
+    'fuzzy': "(name_norm LIKE :like OR name_norm %> :term_norm)",
+    'prefix': "name_norm LIKE :like",
+}
+# name search ranked by similarity and proximity to (:lon, :lat)
+SEARCH_SCORED_SQL = """
+    WITH base AS (
+        -- similarity and distance are each evaluated once per row
+        SELECT id, name, properties, geom,
+               COALESCE(word_similarity(name, :term), 0) AS sim,
+               ST_Distance(geog, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) AS distance_m
+        FROM schools
+        WHERE {match}
+          -- GIST-indexed radius prefilter: only nearby hits pay for scoring
+          AND ST_DWithin(geog, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography, :radius_m)
+    ),
+    ranked AS (
+        SELECT id, name, properties, geom, sim, distance_m,
+               (sim * :sim_weight) + ((1.0 / (1.0 + (distance_m / :scale_m))) * :dist_weight) AS final_score
+        FROM base
+    )
+    SELECT id, name, properties, ST_AsGeoJSON(geom) AS geojson, sim, distance_m, final_score FROM ranked
+    WHERE final_score >= :min_score
+    ORDER BY final_score DESC NULLS LAST
+    LIMIT :limit
+    """
+# name search ranked by similarity alone
+SEARCH_SIMILARITY_SQL = """
+    WITH ranked AS (
+        SELECT id, name, properties, geom,
+               COALESCE(word_similarity(name, :term), 0) AS final_score
+        FROM schools
+        WHERE {match}
+    )
+    SELECT id, name, properties, ST_AsGeoJSON(geom) AS geojson, final_score FROM ranked
+    WHERE final_score >= :min_score
+    ORDER BY final_score DESC NULLS LAST
+    LIMIT :limit
+    """
+SQL_SEARCH_SCORED = {mode: text(SEARCH_SCORED_SQL.replace('{match}', match)) for mode, match in SEARCH_MATCH.items()}
+SQL_SEARCH_SIMILARITY = {mode: text(SEARCH_SIMILARITY_SQL.replace('{match}', match)) for mode, match in SEARCH_MATCH.items()}
+
+
+def like_escape(value):
+    # treat the user's % and _ literally in a LIKE pattern
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def item_coord(item, key):
+    # Nominatim returns coordinates as strings; missing ones sort last as NaN
+    try:
+        return float(item[key])
+    except (KeyError, TypeError, ValueError):
+        return np.nan
 
 
 @app.route('/schools/search')
@@ -850,9 +1206,11 @@ def schools_search():
     """Search schools by name (partial match). If `external=1` is provided and no local
     matches are found, the server will query Nominatim and return results as extra features.
     Returns a GeoJSON FeatureCollection with source property indicating 'db' or 'nominatim'.
+    With `prefix=1` (autocomplete) only names starting with the term match.
     """
     term = (request.args.get('term') or '').strip()
     external = request.args.get('external', '0') == '1'
+    mode = 'prefix' if request.args.get('prefix', '0') == '1' else 'fuzzy'
     try:
         limit = int(request.args.get('limit', 50))
     except Exception:
@@ -861,207 +1219,166 @@ def schools_search():
     if not term:
         return jsonify({"type": "FeatureCollection", "features": []})
 
-    session = get_session()
-    try:
-        like = f"%{term}%"
-        # attempt to use both trigram similarity and optional spatial proximity
-        lon = request.args.get('lon')
-        lat = request.args.get('lat')
-        try:
-            lon_f = float(lon) if lon is not None else None
-            lat_f = float(lat) if lat is not None else None
-        except Exception:
-            lon_f = lat_f = None
-
-        sim_weight = float(request.args.get('sim_weight') or 0.7)
-        dist_weight = float(request.args.get('dist_weight') or 0.3)
-        # scale distance in meters where scale_m ~ 1000 gives 1/(1 + d/1000) behavior
-        scale_m = float(request.args.get('scale_m') or 1000.0)
-        min_score = float(request.args.get('min_score') or 0.03)
-
-        features = []
-
-        if lon_f is not None and lat_f is not None:
-            # combine similarity and distance into a final_score
-            sql = text(
-                """
-                SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson,
-                       greatest(COALESCE(word_similarity(name, :term),0), COALESCE(similarity(properties->>'NAME', :term),0)) AS sim,
-                       ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) AS distance_m,
-                       (
-                           (greatest(COALESCE(word_similarity(name, :term),0), COALESCE(similarity(properties->>'NAME', :term),0)) * :sim_weight)
-                           +
-                           ((1.0 / (1.0 + (ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) / :scale_m))) * :dist_weight)
-                       ) AS final_score
-                FROM schools
-                WHERE (name ILIKE :like OR properties->>'NAME' ILIKE :like)
-                ORDER BY final_score DESC NULLS LAST
-                LIMIT :limit
-                """
-            )
-            res = session.execute(sql, {"term": term, "like": like, "limit": limit, "lon": lon_f, "lat": lat_f, "sim_weight": sim_weight, "dist_weight": dist_weight, "scale_m": scale_m})
-            rows = res.mappings().all()
-
-            for r in rows:
-                props = r.get('properties') or {}
-                if r.get('name') and not props.get('name'):
-                    props['name'] = r.get('name')
-                props['score'] = float(r.get('final_score') or 0.0)
-                # attach raw sim and distance for debugging/inspection
-                props['sim'] = float(r.get('sim') or 0.0)
-                props['distance_m'] = float(r.get('distance_m') or 0.0)
-                props['source'] = 'db'
-                if props['score'] >= min_score:
-                    features.append({
-                        "type": "Feature",
-                        "properties": props,
-                        "geometry": r.get('geojson'),
-                        "id": r.get('id'),
-                    })
-        else:
-            # fallback: similarity-only ranking
-            sql = text(
-                """
-                SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson,
-                       greatest(COALESCE(word_similarity(name, :term),0), COALESCE(similarity(properties->>'NAME', :term),0)) AS final_score
-                FROM schools
-                WHERE name ILIKE :like OR properties->>'NAME' ILIKE :like
-                ORDER BY final_score DESC NULLS LAST
-                LIMIT :limit
-                """
-            )
-            res = session.execute(sql, {"term": term, "like": like, "limit": limit})
-            rows = res.mappings().all()
-            for r in rows:
-                props = r.get('properties') or {}
-                if r.get('name') and not props.get('name'):
-                    props['name'] = r.get('name')
-                props['score'] = float(r.get('final_score') or 0.0)
-                props['source'] = 'db'
-                if props['score'] >= min_score:
-                    features.append({
-                        "type": "Feature",
-                        "properties": props,
-                        "geometry": r.get('geojson'),
-                        "id": r.get('id'),
-                    })
-
-        # If no local results and external requested, call Nominatim (cached)
-        if not features and external:
-            # perform or return cached nominatim results
-            q = term
-            nom_results = None
-            try:
-                with cache_lock:
-                    nom_results = nominatim_cache.get(q)
-                if nom_results is None:
-                    import requests
-                    r = requests.get(
-                        'https://nominatim.openstreetmap.org/search',
-                        params={
-                            'q': q,
-                            'format': 'json',
-                            'limit': 10,
-                            'polygon_geojson': 1,
-                            'addressdetails': 1,
-                        },
-                        headers={'User-Agent': 'flask-app-deploy/1.0 (example@example.com)'} ,
-                        timeout=10,
-                    )
-                    nom_results = r.json()
-                    with cache_lock:
-                        nominatim_cache[q] = nom_results
-                        save_cache()
-            except Exception:
-                nom_results = nom_results or []
-
-            for item in (nom_results or []):
-                geom = item.get('geojson')
-                # some nominatim items may not include geojson geometry; skip those
-                if not geom:
-                    continue
-                props = {
-                    'display_name': item.get('display_name'),
-                    'osm_id': item.get('osm_id'),
-                    'class': item.get('class'),
-                    'type': item.get('type'),
-                    'source': 'nominatim',
-                    'name': item.get('display_name'),
-                }
-                features.append({
-                    'type': 'Feature',
-                    'properties': props,
-                    'geometry': geom,
-                    'id': f"nominatim-{item.get('osm_id')}",
-                })
-
-        return jsonify({"type": "FeatureCollection", "features": features})
-    finally:
-        session.close()
-    if not term:
-        return jsonify({"type": "FeatureCollection", "features": []})
-
-    session = get_session()
+    # name_norm is stored lower-cased, so a plain LIKE replaces ILIKE
+    term_norm = term.lower()
+    like = like_escape(term_norm) + '%' if mode == 'prefix' else f"%{like_escape(term_norm)}%"
+    # attempt to use both trigram similarity and optional spatial proximity
+    lon = request.args.get('lon')
+    lat = request.args.get('lat')
     try:
-        # search name column or properties JSON for partial matches (case-insensitive)
-        sql = text(
-            "SELECT id, name, properties, ST_AsGeoJSON(geom) AS geojson "
-            "FROM schools "
-            "WHERE COALESCE(name, '') ILIKE :p OR COALESCE(properties->>'NAME','') ILIKE :p "
-            "LIMIT 50"
-        )
-        p = f"%{term}%"
-        rows = session.execute(sql.bindparams(p=p)).all()
-        features = []
-        for r in rows:
-            geom_json = r.geojson
-            geometry = None
-            if geom_json:
-                try:
-                    geometry = json.loads(geom_json)
-                except Exception:
-                    geometry = None
-            props = r.properties or {}
-            if r.name and not props.get('name'):
-                props['name'] = r.name
+        lon_f = float(lon) if lon is not None else None
+        lat_f = float(lat) if lat is not None else None
+    except Exception:
+        lon_f = lat_f = None
+
+    sim_weight = float(request.args.get('sim_weight') or 0.7)
+    dist_weight = float(request.args.get('dist_weight') or 0.3)
+    # scale distance in meters where scale_m ~ 1000 gives 1/(1 + d/1000) behavior
+    scale_m = float(request.args.get('scale_m') or 1000.0)
+    # proximity searches only consider schools within radius_m (default 5 x scale_m)
+    radius_m = float(request.args.get('radius_m') or scale_m * SEARCH_RADIUS_SCALES)
+    min_score = float(request.args.get('min_score') or 0.03)
+
+    params = {
+        'term': term, 'mode': mode, 'external': external, 'limit': limit, 'lon': lon_f, 'lat': lat_f,
+        'sim_weight': sim_weight, 'dist_weight': dist_weight, 'scale_m': scale_m,
+        'radius_m': radius_m, 'min_score': min_score, 'version': schools_version(),
+    }
+    cache_key = 'search:' + hashlib.blake2b(orjson.dumps(params, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+    body = get_shared(cache_key)
+    if body is not None:
+        return Response(body, mimetype='application/json')
+
+    session = Session()
+    if mode == 'fuzzy':
+        # %> (word similarity) also matches misspellings; both operators use the
+        # GIN trigram index on name_norm. The threshold applies to this transaction only.
+        session.execute(SQL_SEARCH_THRESHOLD, {'threshold': str(SEARCH_WORD_SIMILARITY)})
+    features = []
+
+    if lon_f is not None and lat_f is not None:
+        # combine similarity and distance into a final_score
+        res = session.execute(SQL_SEARCH_SCORED[mode], {"term": term, "term_norm": term_norm, "like": like, "limit": limit, "min_score": min_score, "lon": lon_f, "lat": lat_f, "sim_weight": sim_weight, "dist_weight": dist_weight, "scale_m": scale_m, "radius_m": radius_m}, execution_options=SEARCH_STREAM)
+        # rows arrive SEARCH_FETCH_ROWS at a time from a server-side cursor, so a
+        # large limit never holds every raw row at once
+        for r in res.mappings():
+            props = r.get('properties') or {}
+            if r.get('name') and not props.get('name'):
+                props['name'] = r.get('name')
+            props['score'] = float(r.get('final_score') or 0.0)
+            # attach raw sim and distance for debugging/inspection
+            props['sim'] = float(r.get('sim') or 0.0)
+            props['distance_m'] = float(r.get('distance_m') or 0.0)
             props['source'] = 'db'
-            features.append({"type": "Feature", "id": r.id, "properties": props, "geometry": geometry})
+            features.append({
+                "type": "Feature",
+                "properties": props,
+                "geometry": geojson_fragment(r.get('geojson')),
+                "id": r.get('id'),
+            })
+    else:
+        # fallback: similarity-only ranking
+        res = session.execute(SQL_SEARCH_SIMILARITY[mode], {"term": term, "term_norm": term_norm, "like": like, "limit": limit, "min_score": min_score}, execution_options=SEARCH_STREAM)
+        for r in res.mappings():
+            props = r.get('properties') or {}
+            if r.get('name') and not props.get('name'):
+                props['name'] = r.get('name')
+            props['score'] = float(r.get('final_score') or 0.0)
+            props['source'] = 'db'
+            features.append({
+                "type": "Feature",
+                "properties": props,
+                "geometry": geojson_fragment(r.get('geojson')),
+                "id": r.get('id'),
+            })
 
-        if not features and include_external:
-            # Query Nominatim (GeoJSON) for the term with keyword 'school' to bias results
-            try:
-                key = term.lower()
-                # check cache first
-                cached = nominatim_cache.get(key)
-                if cached:
-                    for feat in cached:
-                        props = feat.get('properties', {})
-                        props['source'] = 'nominatim'
-                        features.append({"type": "Feature", "id": props.get('osm_id'), "properties": props, "geometry": feat.get('geometry')})
-                else:
-                    nom_url = 'https://nominatim.openstreetmap.org/search'
-                    params = {'q': f"{term} school", 'format': 'geojson', 'limit': 5}
-                    resp = requests.get(nom_url, params=params, headers={'User-Agent': 'flask-app-deploy/1.0'}, timeout=5)
-                    if resp.status_code == 200:
-                        gj = resp.json()
-                        feats = []
-                        for feat in gj.get('features', []):
-                            props = feat.get('properties', {})
-                            props['source'] = 'nominatim'
-                            features.append({"type": "Feature", "id": props.get('osm_id'), "properties": props, "geometry": feat.get('geometry')})
-                            feats.append(feat)
-                        # cache results
-                        try:
-                            nominatim_cache[key] = feats
-                            save_cache()
-                        except Exception:
-                            pass
-            except Exception:
-                pass
+    # If no local results and external requested, call Nominatim (cached)
+    if not features and external:
+        # perform or return cached nominatim results
+        q = term
+        nom_results = None
+        try:
+            nom_results = geocache.get(q)
+            if nom_results is None:
+                r = NOMINATIM_SESSION.get(
+                    NOMINATIM_URL,
+                    params={
+                        'q': q,
+                        'format': 'json',
+                        'limit': 10,
+                        'polygon_geojson': 1,
+                        'addressdetails': 1,
+                    },
+                    timeout=10,
+                )
+                nom_results = r.json()
+                geocache.set(q, nom_results)
+        except Exception:
+            nom_results = nom_results or []
+
+        # some nominatim items may not include geojson geometry; skip those
+        nom_items = [item for item in (nom_results or []) if item.get('geojson')]
+        if nom_items and lon_f is not None and lat_f is not None:
+            # rank by distance to the caller's point, one vectorized pass over all items
+            dist = haversine_m(lat_f, lon_f, np.array([item_coord(i, 'lat') for i in nom_items]),
+                               np.array([item_coord(i, 'lon') for i in nom_items]))
+            order = np.argsort(dist, kind='stable')
+            nom_items = [dict(nom_items[i], distance_m=float(dist[i])) for i in order]
+
+        for item in nom_items:
+            geom = item.get('geojson')
+            props = {
+                'display_name': item.get('display_name'),
+                'osm_id': item.get('osm_id'),
+                'class': item.get('class'),
+                'type': item.get('type'),
+                'source': 'nominatim',
+                'name': item.get('display_name'),
+            }
+            if item.get('distance_m') is not None and not np.isnan(item['distance_m']):
+                props['distance_m'] = item['distance_m']
+            features.append({
+                'type': 'Feature',
+                'properties': props,
+                'geometry': geom,
+                'id': f"nominatim-{item.get('osm_id')}",
+            })
 
-        return jsonify({"type": "FeatureCollection", "features": features})
-    finally:
-        session.close()
+    resp = jsonify({"type": "FeatureCollection", "features": features})
+    set_shared(cache_key, resp.get_data(), SEARCH_CACHE_TTL)
+    return resp
+
+
+# an existing school this close (in metres) to a new one is treated as the same school
+DUPLICATE_RADIUS_M = 50.0
+# Nearest-neighbour check and insert in one round-trip: `<->` on the geography
+# column walks idx_schools_geog_gist for the single closest school, and the
+# INSERT only runs when that school is further than :radius. The GeoJSON is
+# parsed once, by PostGIS, which also supplies the centroid; an empty geometry
+# has no centroid, so nothing matches and the row is always inserted.
+SQL_ADD_SCHOOL = text("""
+    WITH shape AS (
+        SELECT ST_SetSRID(ST_GeomFromGeoJSON(:geojson), 4326) AS geom
+    ),
+    pt AS (
+        SELECT ST_Centroid(geom)::geography AS g FROM shape WHERE NOT ST_IsEmpty(geom)
+    ),
+    candidate AS (
+        SELECT s.id, ST_Distance(s.geog, pt.g) AS dist
+        FROM schools s, pt
+        ORDER BY s.geog <-> pt.g
+        LIMIT 1
+    ),
+    inserted AS (
+        INSERT INTO schools (name, county, properties, geom, created_at, updated_at)
+        SELECT :name, :county, :props, shape.geom, :now, :now
+        FROM shape
+        WHERE NOT EXISTS (SELECT 1 FROM candidate WHERE dist < :radius)
+        RETURNING id
+    )
+    SELECT (SELECT id FROM inserted) AS new_id,
+           (SELECT id FROM candidate WHERE dist < :radius) AS existing_id
+""").bindparams(bindparam('props', type_=JSONB))
 
 
 @app.route('/schools/add', methods=['POST'])
@@ -1079,72 +1396,56 @@ def schools_add():
     if not geom:
         return jsonify({"error": "feature.geometry required"}), 400
 
-    try:
-        shapely_geom = shapely_shape(geom)
-        wkt = WKTElement(shapely_geom.wkt, srid=4326)
-    except Exception as e:
-        return jsonify({"error": f"invalid geometry: {e}"}), 400
+    if not isinstance(geom, dict) or not isinstance(geom.get('type'), str):
+        return jsonify({"error": "invalid geometry: expected a GeoJSON geometry object"}), 400
 
     name = props.get('name') or props.get('NAME') or props.get('display_name')
-    session = get_session()
+    county = next((props[k] for k in COUNTY_KEYS if props.get(k)), None)
+    # the county lives in its own column; don't keep a second copy in properties
+    stored_props = {k: v for k, v in props.items() if k not in COUNTY_KEYS}
+
+    session = Session()
     try:
-        # deduplicate: if an existing feature exists within 50 meters of the geometry, return it instead
-        try:
-            # compute centroid for non-point geometries
-            if geom.get('type') == 'Point' and isinstance(geom.get('coordinates'), (list, tuple)):
-                lon_c, lat_c = geom['coordinates'][0], geom['coordinates'][1]
-            else:
-                centroid = shapely_shape(geom).centroid
-                lon_c, lat_c = float(centroid.x), float(centroid.y)
-        except Exception:
-            lon_c, lat_c = None, None
-
-        if lon_c is not None:
-            dup_sql = text(
-                "SELECT id, ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) as dist "
-                "FROM schools WHERE ST_DWithin(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography, :radius) "
-                "ORDER BY dist LIMIT 1"
-            )
-            radius_m = 50.0
-            dup = session.execute(dup_sql.bindparams(lon=lon_c, lat=lat_c, radius=radius_m)).first()
-            if dup:
-                return jsonify({"duplicate": True, "existing_id": dup.id}), 200
-
-        school = School(name=name, properties=props, geom=wkt)
-        session.add(school)
+        row = session.execute(SQL_ADD_SCHOOL, {
+            'name': name, 'county': county, 'props': stored_props, 'geojson': orjson.dumps(geom).decode('utf-8'),
+            'radius': DUPLICATE_RADIUS_M, 'now': datetime.utcnow(),
+        }).one()
         session.commit()
+        if row.new_id is None:
+            return jsonify({"duplicate": True, "existing_id": row.existing_id}), 200
+
+        invalidate(SCHOOLS_CACHE_KEY)
+        delete_shared(SCHOOLS_VERSION_KEY)
+        schedule_view_refresh()
         # return created feature
-        return jsonify({"type": "Feature", "id": school.id, "properties": props, "geometry": geom})
+        return jsonify({"type": "Feature", "id": row.new_id, "properties": props, "geometry": geom})
+    except (DataError, InternalError) as e:
+        # ST_GeomFromGeoJSON rejects malformed geometries
+        session.rollback()
+        return jsonify({"error": f"invalid geometry: {e.orig}"}), 400
     except Exception as e:
         session.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        session.close()
+
+
+SQL_SCHOOL_GET = text(
+    "SELECT id, name, properties, ST_AsGeoJSON(geom)::json AS geojson FROM schools WHERE id = :id"
+)
 
 
 @app.route('/schools/<int:school_id>')
+@conditional_on_schools
 def school_get(school_id: int):
     """Return a single school feature by id."""
-    session = get_session()
-    try:
-        sql = text(
-            "SELECT id, name, properties, ST_AsGeoJSON(geom) AS geojson FROM schools WHERE id = :id"
-        )
-        row = session.execute(sql.bindparams(id=school_id)).first()
-        if not row:
-            return jsonify({"error": "not found"}), 404
-        geom = None
-        if row.geojson:
-            try:
-                geom = json.loads(row.geojson)
-            except Exception:
-                geom = None
-        props = row.properties or {}
-        if row.name and not props.get('name'):
-            props['name'] = row.name
-        return jsonify({"type": "Feature", "id": row.id, "properties": props, "geometry": geom})
-    finally:
-        session.close()
+    session = Session()
+    row = session.execute(SQL_SCHOOL_GET, {'id': school_id}).first()
+    if not row:
+        return jsonify({"error": "not found"}), 404
+    geom = row.geojson
+    props = row.properties or {}
+    if row.name and not props.get('name'):
+        props['name'] = row.name
+    return jsonify({"type": "Feature", "id": row.id, "properties": props, "geometry": geom})
 
 
 if __name__ == '__main__':
@@ -1,5 +1,5 @@
 from sqlalchemy import text
-from db import engine
+from db import get_engine
 
 def upgrade_database():
     """
@@ -131,24 +131,161 @@ def upgrade_database():
         END $$;
         """,
         
-        # Create indexes for performance
+        # properties moves from json to jsonb; dependants are recreated below
         """
-        CREATE INDEX IF NOT EXISTS idx_enrollment_history_school ON enrollment_history(school_id);
-        CREATE INDEX IF NOT EXISTS idx_inspection_history_school ON inspection_history(school_id);
-        CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'schools' AND column_name = 'properties') = 'json' THEN
+                DROP MATERIALIZED VIEW IF EXISTS schools_summary;
+                ALTER TABLE schools DROP COLUMN IF EXISTS name_norm;
+                ALTER TABLE schools ALTER COLUMN properties TYPE jsonb USING properties::jsonb;
+            END IF;
+        END $$;
         """,
+
+        # staff.qualifications likewise (tables made by create_all used json)
         """
-        CREATE INDEX IF NOT EXISTS idx_schools_code ON schools(code);
-        CREATE INDEX IF NOT EXISTS idx_schools_type ON schools(school_type);
-        CREATE INDEX IF NOT EXISTS idx_schools_county ON schools(county);
-        CREATE INDEX IF NOT EXISTS idx_schools_performance ON schools(performance_index);
-        CREATE INDEX IF NOT EXISTS idx_staff_role ON staff(role);
-        CREATE INDEX IF NOT EXISTS idx_incidents_status ON incidents(status);
-        CREATE INDEX IF NOT EXISTS idx_incidents_type ON incidents(type);
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'staff' AND column_name = 'qualifications') = 'json' THEN
+                ALTER TABLE staff ALTER COLUMN qualifications TYPE jsonb USING qualifications::jsonb;
+            END IF;
+        END $$;
         """,
+
+        # Normalized, lower-cased name used by the trigram search
+        """
+        ALTER TABLE schools
+            ADD COLUMN IF NOT EXISTS name_norm TEXT
+            GENERATED ALWAYS AS (lower(coalesce(name, properties->>'NAME'))) STORED;
+        """,
+
+        # geom cast to geography once at write time; metre-based distance and
+        # radius queries read this instead of casting every row per query
+        """
+        ALTER TABLE schools
+            ADD COLUMN IF NOT EXISTS geog geography(GEOMETRY, 4326)
+            GENERATED ALWAYS AS (geom::geography) STORED;
+        """,
+
+        # county is a real column now: fill it for rows loaded before it was
+        # promoted, and rebuild a summary view still grouping on properties
+        """
+        UPDATE schools
+        SET county = COALESCE(properties->>'county', properties->>'COUNTY', properties->>'admin', properties->>'ADMIN')
+        WHERE county IS NULL
+          AND COALESCE(properties->>'county', properties->>'COUNTY', properties->>'admin', properties->>'ADMIN') IS NOT NULL;
+        """,
+        # ...and drop the promoted keys from properties so the two cannot drift apart
+        """
+        UPDATE schools
+        SET properties = properties - ARRAY['county', 'COUNTY', 'admin', 'ADMIN']
+        WHERE properties ?| ARRAY['county', 'COUNTY', 'admin', 'ADMIN'];
+        """,
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_matviews
+                       WHERE matviewname = 'schools_summary' AND definition LIKE '%properties%') THEN
+                DROP MATERIALIZED VIEW schools_summary;
+            END IF;
+        END $$;
+        """,
+
+        # Per-county counts and extents served by /schools/stats/details
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS schools_summary AS
+        SELECT COALESCE(county, 'UNKNOWN') AS county,
+               count(*) AS n,
+               ST_SetSRID(ST_Extent(geom)::geometry, 4326) AS bbox
+        FROM schools
+        GROUP BY 1;
+        """,
+        # 1 km heat-grid cells (EPSG:3857) served by /schools/heatgrid
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS schools_grid_1000 AS
+        SELECT ST_X(cell) AS cx, ST_Y(cell) AS cy, cell AS g3857, count(*) AS cnt
+        FROM (SELECT ST_SnapToGrid(ST_Transform(ST_Centroid(geom), 3857), 1000, 1000) AS cell
+              FROM schools WHERE geom IS NOT NULL) s
+        GROUP BY cell;
+        """,
+        # School-wide resource averages for the analytics page (one row)
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS school_resource_stats AS
+        SELECT 1 AS id,
+               AVG(teacher_count)::float8 AS avg_teachers,
+               AVG(staff_count)::float8 AS avg_staff,
+               AVG(classrooms)::float8 AS avg_classrooms,
+               AVG(labs)::float8 AS avg_labs,
+               AVG(libraries)::float8 AS avg_libraries,
+               AVG(computer_labs)::float8 AS avg_computer_labs,
+               AVG(teacher_count * 1.0 / NULLIF(current_enrollment, 0))::float8 AS teacher_student_ratio
+        FROM schools;
+        """,
+    ]
+
+    # Index builds run CONCURRENTLY so reads and writes continue meanwhile. That
+    # cannot happen inside a transaction block, so each is its own autocommit
+    # statement. A build that fails leaves an INVALID index behind, which
+    # IF NOT EXISTS then skips: drop it and re-run the upgrade.
+    index_commands = [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_enrollment_history_school ON enrollment_history(school_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inspection_history_school ON inspection_history(school_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_username ON users(username);",
+        # Nearest-neighbour (<->) and && bbox filters need GIST on geom; without it
+        # they fall back to a sequential scan and sort. GIST is the read-biased choice
+        # for this table; BRIN only suits append-only, physically ordered data.
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS schools_geom_gist ON schools USING GIST (geom) WITH (fillfactor = 90);",
+        # duplicate of schools_geom_gist that create_all used to add automatically
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_schools_geom;",
+        # Geography radius filters and KNN (ST_DWithin(geog, ...), geog <-> ...) use this index;
+        # it replaces the old expression index on (geom::geography)
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schools_geog_gist ON schools USING GIST (geog) WITH (fillfactor = 90);",
+        "DROP INDEX CONCURRENTLY IF EXISTS schools_geog_gist;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schools_code ON schools(code);",
+        # Covering indexes: the county / school_type filtered aggregates (dashboard,
+        # analytics) read every column they need from the index, so with a
+        # vacuumed table they run as index-only scans without heap fetches.
+        # properties is left out: large jsonb values would overflow a B-tree entry.
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schools_type_cover ON schools(school_type) INCLUDE (id, mean_score, performance_index);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schools_county_cover ON schools(county) INCLUDE (id, current_enrollment, student_capacity);",
+        # superseded by the covering indexes above
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_schools_type;",
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_schools_county;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schools_performance ON schools(performance_index);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_staff_role ON staff(role);",
+        # jsonb_path_ops answers the `qualifications @? '$.degree'` probe
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_staff_qualifications_gin ON staff USING GIN (qualifications jsonb_path_ops);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_incidents_status ON incidents(status);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_incidents_type ON incidents(type);",
+        # Analytics aggregates answered by index-only scans. The "recent incidents"
+        # filter uses a bound date, so a reported_at key with the grouped columns
+        # INCLUDEd replaces a NOW()-based partial index (not allowed: not immutable).
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_incidents_recent ON incidents(reported_at) INCLUDE (type, severity, status);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inspection_history_recent ON inspection_history(inspected_at) INCLUDE (score);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facilities_maint ON facilities(condition, last_maintenance);",
+        # REFRESH ... CONCURRENTLY on the views needs these unique indexes
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS schools_summary_county ON schools_summary (county);",
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS schools_grid_1000_cell ON schools_grid_1000 (cx, cy);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS schools_grid_1000_gist ON schools_grid_1000 USING GIST (g3857);",
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS school_resource_stats_id ON school_resource_stats (id);",
+        # A single trigram index on name_norm supersedes the separate name / properties->>'NAME' ones
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS schools_name_norm_trgm ON schools USING GIN (name_norm gin_trgm_ops)
+            WITH (fastupdate = on, gin_pending_list_limit = 65536);
+        """,
+        # Prefix autocomplete (name_norm LIKE 'term%') as a B-tree range scan;
+        # text_pattern_ops makes LIKE usable regardless of the database collation
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schools_name_norm_prefix ON schools (name_norm text_pattern_ops);",
+        "DROP INDEX CONCURRENTLY IF EXISTS schools_name_trgm;",
+        "DROP INDEX CONCURRENTLY IF EXISTS schools_props_name_trgm;",
     ]
-    
-    with engine.begin() as conn:
+
+    with get_engine().begin() as conn:
+        # DDL on large tables can outlast the per-request statement timeout
+        conn.execute(text("SET LOCAL statement_timeout = 0;"))
         for command in commands:
             try:
                 conn.execute(text(command))
@@ -156,6 +293,21 @@ def upgrade_database():
                 print(f"Error executing command: {e}")
                 raise
 
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # session-level, since there is no transaction for SET LOCAL to scope to
+        conn.execute(text("SET statement_timeout = 0;"))
+        try:
+            for command in index_commands:
+                try:
+                    conn.execute(text(command))
+                except Exception as e:
+                    print(f"Error executing command: {e}")
+                    raise
+            # index-only scans need an up-to-date visibility map, and the planner fresh stats
+            conn.execute(text("VACUUM (ANALYZE) schools, incidents, inspection_history, facilities;"))
+        finally:
+            conn.execute(text("RESET statement_timeout;"))
+
 if __name__ == "__main__":
     upgrade_database()
     print("Database schema upgraded successfully")
\ No newline at end of file
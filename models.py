@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, JSON, Float, Date, ForeignKey, Table, DateTime
-from sqlalchemy.orm import relationship
-from geoalchemy2 import Geometry
+from sqlalchemy import Column, Computed, Integer, String, Float, Date, ForeignKey, Table, DateTime
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.dialects.postgresql import JSONB
+from geoalchemy2 import Geography, Geometry
 from datetime import datetime
 from db import Base
 
@@ -10,15 +11,28 @@ school_programs = Table('school_programs', Base.metadata,
     Column('program_id', Integer, ForeignKey('programs.id'))
 )
 
+# Source property keys that may carry the county/admin area, in order of
+# preference; the first one set is promoted to School.county
+COUNTY_KEYS = ("county", "COUNTY", "admin", "ADMIN")
+
 class School(Base):
     __tablename__ = "schools"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, nullable=False)
+    # Lower-cased search key, normalized once at write time for trigram lookups
+    name_norm = Column(String, Computed("lower(coalesce(name, properties->>'NAME'))", persisted=True))
     code = Column(String(20), unique=True)  # Unique school identifier
     school_type = Column(String)  # Primary, Secondary, etc.
-    properties = Column(JSON, nullable=True)
-    geom = Column(Geometry(geometry_type='GEOMETRY', srid=4326))
+    properties = Column(JSONB, nullable=True)  # source attributes minus promoted columns
+    # spatial_index=False: schools_geom_gist is built after the bulk load (load_data.create_indexes)
+    geom = Column(Geometry(geometry_type='GEOMETRY', srid=4326, spatial_index=False))
+    # geom cast to geography once at write time, for metre-based distance/radius queries;
+    # deferred so ORM loads don't fetch a second copy of every geometry
+    geog = deferred(Column(
+        Geography(geometry_type='GEOMETRY', srid=4326, spatial_index=False),
+        Computed("geom::geography", persisted=True),
+    ))
     
     # Administrative details
     county = Column(String)
@@ -83,7 +97,7 @@ class Staff(Base):
     school_id = Column(Integer, ForeignKey('schools.id'))
     name = Column(String, nullable=False)
     role = Column(String)  # Teacher, Administrator, Support Staff
-    qualifications = Column(JSON)
+    qualifications = Column(JSONB)
     joining_date = Column(Date)
     school = relationship('School', back_populates='staff')
 
@@ -1,40 +1,55 @@
 """
 Generate historical enrollment and inspection records from current schools.
+
+Rows are streamed to PostgreSQL with COPY ... FROM STDIN, so the whole run is
+a handful of round-trips however many schools there are.
 """
 import random
 from datetime import datetime, timedelta
 from db import get_session
 from models import School
-from sqlalchemy import text
+from sqlalchemy import select, text
+
+ENROLLMENT_COPY = "COPY enrollment_history (school_id, recorded_at, enrollment, capacity) FROM STDIN"
+INSPECTION_COPY = "COPY inspection_history (school_id, inspected_at, inspector, score, notes) FROM STDIN"
 
 
 def generate_history(months=24):
     session = get_session()
     try:
-        schools = session.query(School).all()
+        # bulk COPY: lift the web requests' per-statement limit for this transaction
+        session.execute(text("SET LOCAL statement_timeout = 0"))
+        schools = session.execute(
+            select(School.id, School.current_enrollment, School.student_capacity)
+        ).all()
         now = datetime.now()
-        for school in schools:
-            base_enroll = school.current_enrollment or random.randint(300, 1200)
-            base_capacity = school.student_capacity or (base_enroll + random.randint(50, 500))
+        enrollment_rows = []
+        inspection_rows = []
+        for school_id, current_enrollment, student_capacity in schools:
+            base_enroll = current_enrollment or random.randint(300, 1200)
+            base_capacity = student_capacity or (base_enroll + random.randint(50, 500))
             for m in range(months):
                 recorded_at = now - timedelta(days=30 * m)
                 # simulate seasonal fluctuation
                 fluct = int(base_enroll * (1 + random.uniform(-0.08, 0.08)))
-                session.execute(
-                    text("INSERT INTO enrollment_history (school_id, recorded_at, enrollment, capacity) VALUES (:sid, :rec, :enr, :cap)"),
-                    {"sid": school.id, "rec": recorded_at, "enr": fluct, "cap": base_capacity}
-                )
+                enrollment_rows.append((school_id, recorded_at, fluct, base_capacity))
             # inspections: roughly 1 per year
             years = max(1, months // 12)
             for y in range(years):
                 inspected_at = now - timedelta(days=365 * y)
                 score = round(random.uniform(60, 95), 2)
-                session.execute(
-                    text("INSERT INTO inspection_history (school_id, inspected_at, inspector, score, notes) VALUES (:sid, :ins, :insp, :score, :notes)"),
-                    {"sid": school.id, "ins": inspected_at, "insp": f'Inspector {random.randint(1,20)}', "score": score, "notes": 'Auto-generated sample inspection'}
-                )
+                inspection_rows.append((school_id, inspected_at, f'Inspector {random.randint(1,20)}', score, 'Auto-generated sample inspection'))
+
+        raw = session.connection().connection.driver_connection
+        with raw.cursor() as cur:
+            with cur.copy(ENROLLMENT_COPY) as copy:
+                for row in enrollment_rows:
+                    copy.write_row(row)
+            with cur.copy(INSPECTION_COPY) as copy:
+                for row in inspection_rows:
+                    copy.write_row(row)
         session.commit()
-        print('Historical data generated')
+        print(f'Historical data generated: {len(enrollment_rows)} enrollment, {len(inspection_rows)} inspection rows')
     except Exception as e:
         session.rollback()
         print('Error generating history:', e)
@@ -1,86 +1,164 @@
 """
 Script to generate sample education data for testing.
+
+Random fields are drawn as NumPy arrays (one call per column). Schools are
+updated from those arrays in batched set-based UPDATEs; new rows are written
+with bulk mappings, which skip unit-of-work tracking and flush as executemany.
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime
 import random
-from sqlalchemy.sql import text
+import numpy as np
+from sqlalchemy import insert, select, text
 from db import get_session
-from models import School, Staff, Facility, Incident, Program
+from models import School, Staff, Facility, Incident, Program, school_programs
+
+
+# schools updated per statement
+UPDATE_BATCH = 1000
+# One UPDATE per batch: the arrays are unnested into rows and joined on id,
+# instead of one UPDATE per school
+SCHOOL_UPDATE_SQL = text("""
+    UPDATE schools AS s SET
+        school_type = v.school_type,
+        student_capacity = v.student_capacity,
+        current_enrollment = v.current_enrollment,
+        teacher_count = v.teacher_count,
+        staff_count = v.staff_count,
+        classrooms = v.classrooms,
+        labs = v.labs,
+        libraries = v.libraries,
+        computer_labs = v.computer_labs,
+        mean_score = v.mean_score,
+        performance_index = v.performance_index,
+        established_date = v.established_date,
+        last_inspection_date = v.last_inspection_date,
+        updated_at = :now
+    FROM unnest(
+        CAST(:id AS int[]), CAST(:school_type AS text[]),
+        CAST(:student_capacity AS int[]), CAST(:current_enrollment AS int[]),
+        CAST(:teacher_count AS int[]), CAST(:staff_count AS int[]),
+        CAST(:classrooms AS int[]), CAST(:labs AS int[]),
+        CAST(:libraries AS int[]), CAST(:computer_labs AS int[]),
+        CAST(:mean_score AS float8[]), CAST(:performance_index AS float8[]),
+        CAST(:established_date AS date[]), CAST(:last_inspection_date AS date[])
+    ) AS v(id, school_type, student_capacity, current_enrollment, teacher_count, staff_count,
+           classrooms, labs, libraries, computer_labs, mean_score, performance_index,
+           established_date, last_inspection_date)
+    WHERE s.id = v.id
+""")
+
+
+def days_before(now, days):
+    """Datetimes `days` (an int array) before now."""
+    return (np.datetime64(now, 'us') - days.astype('timedelta64[D]')).tolist()
+
 
 def generate_sample_data():
     session = get_session()
+    rng = np.random.default_rng()
     try:
+        # bulk UPDATE/INSERTs: lift the web requests' per-statement limit for this transaction
+        session.execute(text("SET LOCAL statement_timeout = 0"))
         # First get existing schools
-        schools = session.query(School).all()
-        
+        school_ids = np.array(session.execute(select(School.id)).scalars().all(), dtype=np.int64)
+        k = len(school_ids)
+        now = datetime.now()
+
         # Add school types and other basic info
-        school_types = ['Primary', 'Secondary', 'Mixed', 'Special Needs']
-        conditions = ['Good', 'Fair', 'Needs Repair']
-        roles = ['Teacher', 'Administrator', 'Support Staff']
+        school_types = np.array(['Primary', 'Secondary', 'Mixed', 'Special Needs'])
+        conditions = np.array(['Good', 'Fair', 'Needs Repair'])
+        facility_types = np.array(['Classroom Block', 'Laboratory', 'Library', 'Admin Block'])
+        roles = np.array(['Teacher', 'Administrator', 'Support Staff'])
+        incident_types = np.array(['Safety', 'Maintenance', 'Discipline', 'Emergency'])
+        severities = np.array(['Low', 'Medium', 'High'])
         qualifications = [
             {'degree': 'B.Ed', 'experience': '5-10 years'},
             {'degree': 'M.Ed', 'experience': '10+ years'},
             {'degree': 'PhD', 'experience': '15+ years'}
         ]
-        
-        for school in schools:
-            # Update school details
-            school.school_type = random.choice(school_types)
-            school.student_capacity = random.randint(500, 2000)
-            school.current_enrollment = random.randint(300, school.student_capacity)
-            school.teacher_count = max(10, school.current_enrollment // 30)
-            school.staff_count = max(5, school.teacher_count // 4)
-            school.classrooms = max(10, school.current_enrollment // 40)
-            school.labs = random.randint(1, 4)
-            school.libraries = random.randint(1, 2)
-            school.computer_labs = random.randint(1, 3)
-            school.mean_score = round(random.uniform(250, 400), 2)
-            school.performance_index = round(random.uniform(0.6, 0.95), 2)
-            school.established_date = datetime(random.randint(1950, 2010), 
-                                            random.randint(1, 12), 
-                                            random.randint(1, 28))
-            school.last_inspection_date = datetime.now() - timedelta(days=random.randint(30, 365))
-            
-            # Add facilities
-            for _ in range(random.randint(5, 10)):
-                facility = Facility(
-                    school=school,
-                    name=f"Building {random.randint(1,5)}",
-                    type=random.choice(['Classroom Block', 'Laboratory', 'Library', 'Admin Block']),
-                    condition=random.choice(conditions),
-                    last_maintenance=datetime.now() - timedelta(days=random.randint(30, 730))
-                )
-                session.add(facility)
-            
-            # Add staff
-            for _ in range(school.teacher_count + school.staff_count):
-                staff = Staff(
-                    school=school,
-                    name=f"Staff Member {random.randint(1000,9999)}",
-                    role=random.choice(roles),
-                    qualifications=random.choice(qualifications),
-                    joining_date=datetime.now() - timedelta(days=random.randint(30, 3650))
-                )
-                session.add(staff)
-            
-            # Add some incidents
-            for _ in range(random.randint(0, 5)):
-                days_ago = random.randint(1, 365)
-                reported = datetime.now() - timedelta(days=days_ago)
-                resolved = reported + timedelta(days=random.randint(1, 30)) if random.random() > 0.3 else None
-                
-                incident = Incident(
-                    school=school,
-                    type=random.choice(['Safety', 'Maintenance', 'Discipline', 'Emergency']),
-                    description=f"Sample incident from {reported.strftime('%Y-%m-%d')}",
-                    severity=random.choice(['Low', 'Medium', 'High']),
-                    status='Resolved' if resolved else random.choice(['Open', 'In Progress']),
-                    reported_at=reported,
-                    resolved_at=resolved
-                )
-                session.add(incident)
-        
+
+        # Update school details
+        capacity = rng.integers(500, 2001, size=k)
+        enrollment = rng.integers(300, capacity + 1)
+        teachers = np.maximum(10, enrollment // 30)
+        staff_counts = np.maximum(5, teachers // 4)
+        established = [datetime(int(y), int(m), int(d)) for y, m, d in zip(
+            rng.integers(1950, 2011, size=k), rng.integers(1, 13, size=k), rng.integers(1, 29, size=k))]
+        columns = {
+            'id': school_ids.tolist(),
+            'school_type': rng.choice(school_types, size=k).tolist(),
+            'student_capacity': capacity.tolist(),
+            'current_enrollment': enrollment.tolist(),
+            'teacher_count': teachers.tolist(),
+            'staff_count': staff_counts.tolist(),
+            'classrooms': np.maximum(10, enrollment // 40).tolist(),
+            'labs': rng.integers(1, 5, size=k).tolist(),
+            'libraries': rng.integers(1, 3, size=k).tolist(),
+            'computer_labs': rng.integers(1, 4, size=k).tolist(),
+            'mean_score': np.round(rng.uniform(250, 400, size=k), 2).tolist(),
+            'performance_index': np.round(rng.uniform(0.6, 0.95, size=k), 2).tolist(),
+            'established_date': established,
+            'last_inspection_date': days_before(now, rng.integers(30, 366, size=k)),
+        }
+        for start in range(0, k, UPDATE_BATCH):
+            params = {name: values[start:start + UPDATE_BATCH] for name, values in columns.items()}
+            params['now'] = now
+            session.execute(SCHOOL_UPDATE_SQL, params)
+
+        # Add facilities: 5-10 per school
+        owners = np.repeat(school_ids, rng.integers(5, 11, size=k))
+        n = len(owners)
+        session.bulk_insert_mappings(Facility, [
+            {'school_id': sid, 'name': f"Building {b}", 'type': t, 'condition': c, 'last_maintenance': lm}
+            for sid, b, t, c, lm in zip(
+                owners.tolist(),
+                rng.integers(1, 6, size=n).tolist(),
+                rng.choice(facility_types, size=n).tolist(),
+                rng.choice(conditions, size=n).tolist(),
+                days_before(now, rng.integers(30, 731, size=n)),
+            )
+        ])
+
+        # Add staff: teachers plus support staff per school
+        owners = np.repeat(school_ids, teachers + staff_counts)
+        n = len(owners)
+        session.bulk_insert_mappings(Staff, [
+            {'school_id': sid, 'name': f"Staff Member {num}", 'role': r,
+             'qualifications': qualifications[q], 'joining_date': jd}
+            for sid, num, r, q, jd in zip(
+                owners.tolist(),
+                rng.integers(1000, 10000, size=n).tolist(),
+                rng.choice(roles, size=n).tolist(),
+                rng.integers(0, len(qualifications), size=n).tolist(),
+                days_before(now, rng.integers(30, 3651, size=n)),
+            )
+        ])
+
+        # Add some incidents: 0-5 per school, ~70% resolved within a month
+        owners = np.repeat(school_ids, rng.integers(0, 6, size=k))
+        n = len(owners)
+        reported_days = rng.integers(1, 366, size=n)
+        resolved_mask = rng.random(size=n) > 0.3
+        resolve_after = rng.integers(1, 31, size=n)
+        open_status = rng.choice(np.array(['Open', 'In Progress']), size=n)
+        reported = days_before(now, reported_days)
+        resolved = days_before(now, reported_days - resolve_after)
+        session.bulk_insert_mappings(Incident, [
+            {'school_id': sid, 'type': t, 'description': f"Sample incident from {rep.strftime('%Y-%m-%d')}",
+             'severity': sev, 'status': 'Resolved' if done else st,
+             'reported_at': rep, 'resolved_at': res if done else None}
+            for sid, t, sev, done, st, rep, res in zip(
+                owners.tolist(),
+                rng.choice(incident_types, size=n).tolist(),
+                rng.choice(severities, size=n).tolist(),
+                resolved_mask.tolist(),
+                open_status.tolist(),
+                reported,
+                resolved,
+            )
+        ])
+
         # Create some programs
         programs = [
             Program(name="Standard Curriculum", description="Basic education program", level="Primary"),
@@ -88,12 +166,16 @@ def generate_sample_data():
             Program(name="Special Education", description="Inclusive education program", level="Special Needs"),
             Program(name="Arts & Culture", description="Enhanced creative arts program", level="Mixed")
         ]
+        session.add_all(programs)
+        session.flush()
+        # Assign to random schools
+        links = []
         for program in programs:
-            session.add(program)
-            # Assign to random schools
-            for school in random.sample(schools, k=len(schools)//3):
-                school.programs.append(program)
-        
+            for sid in random.sample(school_ids.tolist(), k=k // 3):
+                links.append({'school_id': sid, 'program_id': program.id})
+        if links:
+            session.execute(insert(school_programs), links)
+
         session.commit()
         print("Sample data generated successfully")
         
@@ -105,4 +187,4 @@ def generate_sample_data():
         session.close()
 
 if __name__ == "__main__":
-    generate_sample_data()
\ No newline at end of file
+    generate_sample_data()
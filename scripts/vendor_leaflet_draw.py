@@ -7,6 +7,7 @@ This script will:
 - download leaflet.draw.css and leaflet.draw.js from unpkg.com
 - save files locally
 - compute sha512 integrity values and write integrity.json
+- remember each asset's ETag in etags.json, so a re-run only transfers changed files
 
 Use the vendored files in production for deterministic assets. The app will auto-detect vendored files and prefer them.
 """
@@ -14,10 +15,14 @@ Use the vendored files in production for deterministic assets. The app will auto
 import os
 import sys
 import hashlib
-import base64
+import binascii
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     print('requests is required. Install with: pip install requests')
     sys.exit(1)
@@ -29,18 +34,68 @@ FILES = {
 }
 
 OUT_DIR = os.path.join('static', 'vendor', 'leaflet-draw')
+INTEGRITY_PATH = os.path.join(OUT_DIR, 'integrity.json')
+ETAGS_PATH = os.path.join(OUT_DIR, 'etags.json')
 
 
-def sha512_sri(data: bytes) -> str:
-    h = hashlib.sha512(data).digest()
-    return 'sha512-' + base64.b64encode(h).decode('ascii')
+# bytes read from the response per iteration while streaming an asset to disk
+CHUNK_SIZE = 1 << 16
 
 
-def download(url: str) -> bytes:
+def sri_from_digest(digest: bytes) -> str:
+    return 'sha512-' + binascii.b2a_base64(digest, newline=False).decode('ascii')
+
+
+def download(session, url: str, out_path: str, etag: str = None):
+    """Stream url into out_path, hashing each chunk as it is written.
+
+    The body goes to a temporary file that replaces out_path only once complete,
+    so an interrupted download never leaves a truncated asset for the app to pick up.
+    With an etag the request is conditional; returns (sri, etag), or None when
+    the server answers 304 and the file on disk is still current.
+    """
     print('Downloading', url)
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
-    return r.content
+    headers = {'If-None-Match': etag} if etag else None
+    h = hashlib.sha512()
+    tmp_path = out_path + '.part'
+    try:
+        with session.get(url, timeout=30, stream=True, headers=headers) as r:
+            if r.status_code == 304:
+                return None
+            r.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    h.update(chunk)
+                    f.write(chunk)
+            new_etag = r.headers.get('ETag')
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return sri_from_digest(h.digest()), new_etag
+
+
+def fetch(session, fname: str, etag: str = None, sri: str = None):
+    """Download one asset into OUT_DIR and return (path, SRI, ETag, written).
+
+    The previous ETag is only sent when the file and its SRI are both still
+    present, since a 304 reuses them as they are.
+    """
+    out_path = os.path.join(OUT_DIR, fname)
+    if not (etag and sri and os.path.exists(out_path)):
+        etag = None
+    result = download(session, f"{ASSET_BASE}/{fname}", out_path, etag)
+    if result is None:
+        return out_path, sri, etag, False
+    return (out_path,) + result + (True,)
+
+
+def load_json(path: str) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
 
 def ensure_out_dir():
@@ -49,27 +104,48 @@ def ensure_out_dir():
 
 def main():
     ensure_out_dir()
+    prev_integrity = load_json(INTEGRITY_PATH)
+    prev_etags = load_json(ETAGS_PATH)
     integrity = {}
-    for key, fname in FILES.items():
-        url = f"{ASSET_BASE}/{fname}"
+    etags = {}
+    # one pooled keep-alive session; the assets download in parallel. Connection
+    # errors and 5xx responses are retried, and urllib3 raises on a body shorter
+    # than its Content-Length, so a truncated transfer fails instead of being hashed
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=len(FILES)) as ex:
+        session.mount('https://', HTTPAdapter(max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504))))
+        futures = {
+            ex.submit(fetch, session, fname, prev_etags.get(key), prev_integrity.get(key)): (key, fname)
+            for key, fname in FILES.items()
+        }
+        for fut in as_completed(futures):
+            key, fname = futures[fut]
+            try:
+                out_path, integrity[key], etag, written = fut.result()
+                if etag:
+                    etags[key] = etag
+                if written:
+                    print(f'Wrote {out_path} (SRI: {integrity[key]})')
+                else:
+                    print(f'Unchanged {out_path} (SRI: {integrity[key]})')
+            except Exception as e:
+                print('Failed to download', f"{ASSET_BASE}/{fname}", e)
+                # the previous file is still on disk (failed downloads never
+                # replace it), so keep describing it
+                if key in prev_integrity:
+                    integrity[key] = prev_integrity[key]
+                if key in prev_etags:
+                    etags[key] = prev_etags[key]
+
+    # write integrity.json in one write() rather than json.dump's per-token writes;
+    # the app reads it as {key: sri}, so ETags live in their own file
+    for path, data in ((INTEGRITY_PATH, integrity), (ETAGS_PATH, etags)):
         try:
-            data = download(url)
-            out_path = os.path.join(OUT_DIR, fname)
-            with open(out_path, 'wb') as f:
-                f.write(data)
-            integrity[key] = sha512_sri(data)
-            print(f'Wrote {out_path} (SRI: {integrity[key]})')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, indent=2))
+            print('Wrote', os.path.basename(path))
         except Exception as e:
-            print('Failed to download', url, e)
-
-    # write integrity.json
-    import json
-    try:
-        with open(os.path.join(OUT_DIR, 'integrity.json'), 'w', encoding='utf-8') as f:
-            json.dump(integrity, f, indent=2)
-        print('Wrote integrity.json')
-    except Exception as e:
-        print('Failed to write integrity.json', e)
+            print('Failed to write', os.path.basename(path), e)
 
     print('\nDone. Add static/vendor/leaflet-draw to your version control for reproducible builds.')
 
@@ -1,241 +1,238 @@
-from sqlalchemy import func, and_, or_, text
+from sqlalchemy import func, text
 from datetime import datetime, timedelta
-from models import School, Staff, Incident, Facility
-from db import get_session
+from models import School
+from db import Session
 from typing import Dict, List, Any
 
+# Incident breakdowns plus recent inspection stats for get_incident_summary
+INCIDENT_SUMMARY_SQL = text("""
+    WITH inc AS (
+        SELECT type, severity, status FROM incidents WHERE reported_at >= :since
+    )
+    SELECT 'type' AS kind, type AS bucket, COUNT(*) AS n, NULL::float8 AS avg_score FROM inc GROUP BY type
+    UNION ALL
+    SELECT 'severity', severity, COUNT(*), NULL FROM inc GROUP BY severity
+    UNION ALL
+    SELECT 'open', NULL, COUNT(*) FILTER (WHERE status <> 'Resolved'), NULL FROM inc
+    UNION ALL
+    SELECT 'inspections', NULL, COUNT(*), AVG(score) FROM inspection_history WHERE inspected_at >= :since
+""")
+
+# History-based and current-field enrollment figures in one round-trip;
+# get_enrollment_statistics prefers the history ones when there are any
+ENROLLMENT_STATS_SQL = text("""
+    WITH params AS (
+        SELECT CAST(:county AS text) AS county
+    ),
+    hist AS (
+        SELECT SUM(eh.enrollment) AS total, AVG(eh.enrollment)::float8 AS avg, AVG(eh.capacity)::float8 AS avg_capacity
+        FROM enrollment_history eh JOIN schools s ON eh.school_id = s.id, params p
+        WHERE p.county IS NULL OR s.county = p.county
+    ),
+    cur AS (
+        SELECT SUM(s.current_enrollment) AS total, AVG(s.current_enrollment)::float8 AS avg,
+               SUM(s.student_capacity) AS capacity,
+               AVG(s.current_enrollment * 100.0 / NULLIF(s.student_capacity, 0))::float8 AS utilization
+        FROM schools s, params p
+        WHERE p.county IS NULL OR s.county = p.county
+    )
+    SELECT hist.total AS hist_total, hist.avg AS hist_avg, hist.avg_capacity AS hist_avg_capacity,
+           cur.total AS total_enrollment, cur.avg AS avg_enrollment,
+           cur.capacity AS total_capacity, cur.utilization AS avg_capacity_utilization
+    FROM hist, cur
+""")
+
+# Counts per group plus the filtered total in one pass: GROUPING SETS adds a
+# grand-total row, flagged by GROUPING() = 1 (a NULL group key stays a group)
+FACILITY_STATUS_SQL = text("""
+    SELECT GROUPING(condition) = 1 AS is_total, condition, COUNT(id) AS n,
+           COUNT(id) FILTER (WHERE condition = 'Needs Repair' OR last_maintenance < :cutoff) AS needs_maint
+    FROM facilities
+    GROUP BY GROUPING SETS ((condition), ())
+""")
+STAFF_QUALIFICATIONS_SQL = text("""
+    SELECT GROUPING(role) = 1 AS is_total, role, COUNT(id) AS n,
+           COUNT(id) FILTER (WHERE qualifications @? '$.degree') AS qualified
+    FROM staff
+    GROUP BY GROUPING SETS ((role), ())
+""")
+
+RESOURCE_STATS_SQL = text(
+    "SELECT avg_teachers, avg_staff, avg_classrooms, avg_labs, avg_libraries, "
+    "avg_computer_labs, teacher_student_ratio FROM school_resource_stats"
+)
+
+# Coverage distances are measured from central Nairobi
+REFERENCE_LON, REFERENCE_LAT = 36.817223, -1.286389
+AVG_DISTANCE_SQL = text(
+    "SELECT AVG(ST_Distance(geog, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography)) FROM schools"
+)
+
+# Output key -> school_resource_stats column
+RESOURCE_FIELDS = (
+    ('average_teachers', 'avg_teachers'),
+    ('average_staff', 'avg_staff'),
+    ('average_classrooms', 'avg_classrooms'),
+    ('average_labs', 'avg_labs'),
+    ('average_libraries', 'avg_libraries'),
+    ('average_computer_labs', 'avg_computer_labs'),
+    ('teacher_student_ratio', 'teacher_student_ratio'),
+)
+
+
+def _r2(v):
+    """Round to 2 places; NULL aggregates (no rows) report 0."""
+    return round(v, 2) if v else 0
+
+
 class EducationAnalytics:
-    """Service class for education system analytics and reporting."""
+    """Service class for education system analytics and reporting.
+
+    Methods use the thread's scoped Session, so calls within one request share a
+    connection; the web app returns it to the pool on teardown.
+    """
     
     @staticmethod
     def get_enrollment_statistics(county: str = None) -> Dict[str, Any]:
         """Get enrollment statistics with optional county filter."""
-        session = get_session()
-        try:
-            # Prefer deriving totals from enrollment_history where present
-            res = session.execute(text(
-                "SELECT SUM(enrollment) as total_enrollment, AVG(enrollment) as avg_enrollment, AVG(capacity) as avg_capacity "
-                "FROM enrollment_history eh JOIN schools s ON eh.school_id = s.id "
-                + ("WHERE s.county = :county" if county else "")
-            ), {"county": county} if county else {}).fetchone()
-
-            if res and res.total_enrollment is not None:
-                return {
-                    'total_enrollment': int(res.total_enrollment),
-                    'average_enrollment': round(res.avg_enrollment or 0, 2),
-                    'total_capacity': None,
-                    'capacity_utilization': round(((res.avg_enrollment or 0) * 100.0 / (res.avg_capacity or 1)), 2) if res.avg_capacity else 0
-                }
+        session = Session()
+        stats = session.execute(ENROLLMENT_STATS_SQL, {"county": county or None}).one()
 
-            # Fallback to current fields
-            query = session.query(
-                func.sum(School.current_enrollment).label('total_enrollment'),
-                func.avg(School.current_enrollment).label('avg_enrollment'),
-                func.sum(School.student_capacity).label('total_capacity'),
-                func.avg(
-                    (School.current_enrollment * 100.0 / School.student_capacity)
-                ).label('avg_capacity_utilization')
-            )
-            if county:
-                query = query.filter(School.county == county)
-            stats = query.first()
+        # Prefer deriving totals from enrollment_history where present
+        if stats.hist_total is not None:
             return {
-                'total_enrollment': int(stats.total_enrollment or 0),
-                'average_enrollment': round(stats.avg_enrollment or 0, 2),
-                'total_capacity': int(stats.total_capacity or 0),
-                'capacity_utilization': round(stats.avg_capacity_utilization or 0, 2)
+                'total_enrollment': int(stats.hist_total),
+                'average_enrollment': _r2(stats.hist_avg),
+                'total_capacity': None,
+                'capacity_utilization': _r2((stats.hist_avg or 0) * 100.0 / stats.hist_avg_capacity) if stats.hist_avg_capacity else 0
             }
-        finally:
-            session.close()
+
+        # Fallback to current fields
+        return {
+            'total_enrollment': int(stats.total_enrollment or 0),
+            'average_enrollment': _r2(stats.avg_enrollment),
+            'total_capacity': int(stats.total_capacity or 0),
+            'capacity_utilization': _r2(stats.avg_capacity_utilization)
+        }
     
     @staticmethod
     def get_performance_metrics(school_type: str = None) -> Dict[str, Any]:
         """Get academic performance metrics with optional school type filter."""
-        session = get_session()
-        try:
-            query = session.query(
-                func.avg(School.mean_score).label('avg_score'),
-                func.avg(School.performance_index).label('avg_performance'),
-                func.count(School.id).label('school_count')
-            )
-            
-            if school_type:
-                query = query.filter(School.school_type == school_type)
-            
-            stats = query.first()
-            
-            return {
-                'average_score': round(stats.avg_score or 0, 2),
-                'average_performance_index': round(stats.avg_performance or 0, 2),
-                'total_schools': stats.school_count
-            }
-        finally:
-            session.close()
+        session = Session()
+        query = session.query(
+            func.avg(School.mean_score).label('avg_score'),
+            func.avg(School.performance_index).label('avg_performance'),
+            func.count(School.id).label('school_count')
+        )
+        
+        if school_type:
+            query = query.filter(School.school_type == school_type)
+        
+        stats = query.first()
+        
+        return {
+            'average_score': _r2(stats.avg_score),
+            'average_performance_index': _r2(stats.avg_performance),
+            'total_schools': stats.school_count
+        }
     
     @staticmethod
     def get_resource_distribution() -> Dict[str, Any]:
         """Analyze resource distribution across schools."""
-        session = get_session()
-        try:
-            stats = session.query(
-                func.avg(School.teacher_count).label('avg_teachers'),
-                func.avg(School.staff_count).label('avg_staff'),
-                func.avg(School.classrooms).label('avg_classrooms'),
-                func.avg(School.labs).label('avg_labs'),
-                func.avg(School.libraries).label('avg_libraries'),
-                func.avg(School.computer_labs).label('avg_computer_labs'),
-                func.avg(
-                    (School.teacher_count * 1.0 / School.current_enrollment)
-                ).label('teacher_student_ratio')
-            ).first()
-            
-            return {
-                'average_teachers': round(stats.avg_teachers or 0, 2),
-                'average_staff': round(stats.avg_staff or 0, 2),
-                'average_classrooms': round(stats.avg_classrooms or 0, 2),
-                'average_labs': round(stats.avg_labs or 0, 2),
-                'average_libraries': round(stats.avg_libraries or 0, 2),
-                'average_computer_labs': round(stats.avg_computer_labs or 0, 2),
-                'teacher_student_ratio': round(stats.teacher_student_ratio or 0, 2)
-            }
-        finally:
-            session.close()
+        session = Session()
+        # precomputed by the school_resource_stats materialized view
+        stats = session.execute(RESOURCE_STATS_SQL).one()
+        return {key: _r2(stats._mapping[col]) for key, col in RESOURCE_FIELDS}
     
     @staticmethod
     def get_facility_status() -> Dict[str, Any]:
         """Analyze facility conditions and maintenance status."""
-        session = get_session()
-        try:
-            # Get counts by condition
-            condition_counts = dict(
-                session.query(
-                    Facility.condition,
-                    func.count(Facility.id)
-                ).group_by(Facility.condition).all()
-            )
-            
-            # Get facilities needing maintenance
-            maintenance_needed = session.query(func.count(Facility.id)).filter(
-                or_(
-                    Facility.condition == 'Needs Repair',
-                    Facility.last_maintenance < datetime.now() - timedelta(days=365)
-                )
-            ).scalar()
-            
-            return {
-                'condition_summary': condition_counts,
-                'maintenance_needed': maintenance_needed,
-                'total_facilities': sum(condition_counts.values())
-            }
-        finally:
-            session.close()
+        session = Session()
+        condition_counts = {}
+        maintenance_needed = 0
+        # per-condition counts plus a grand-total row, from one scan
+        for is_total, condition, n, needs_maint in session.execute(
+            FACILITY_STATUS_SQL, {"cutoff": datetime.now() - timedelta(days=365)}
+        ):
+            if is_total:
+                maintenance_needed = needs_maint
+            else:
+                condition_counts[condition] = n
+        
+        return {
+            'condition_summary': condition_counts,
+            'maintenance_needed': maintenance_needed,
+            'total_facilities': sum(condition_counts.values())
+        }
     
     @staticmethod
     def get_incident_summary(days: int = 30) -> Dict[str, Any]:
         """Get summary of incidents in the last n days."""
-        session = get_session()
-        try:
-            since = datetime.now() - timedelta(days=days)
-            # Combine recent incidents and inspection_history for timeline
-            type_counts = dict(
-                session.query(
-                    Incident.type,
-                    func.count(Incident.id)
-                ).filter(
-                    Incident.reported_at >= since
-                ).group_by(Incident.type).all()
-            )
-
-            severity_counts = dict(
-                session.query(
-                    Incident.severity,
-                    func.count(Incident.id)
-                ).filter(
-                    Incident.reported_at >= since
-                ).group_by(Incident.severity).all()
-            )
-
-            open_incidents = session.query(func.count(Incident.id)).filter(
-                Incident.status != 'Resolved',
-                Incident.reported_at >= since
-            ).scalar()
-
-            # Also include inspection_history counts
-            insp_rows = session.execute(text(
-                "SELECT COUNT(*) as cnt, AVG(score) as avg_score FROM inspection_history WHERE inspected_at >= :since"
-            ), {"since": since}).fetchone()
+        session = Session()
+        since = datetime.now() - timedelta(days=days)
+        type_counts, severity_counts = {}, {}
+        open_incidents = insp_count = 0
+        insp_avg = None
+        # one round-trip; rows are tagged with the figure they belong to
+        for kind, bucket, n, avg_score in session.execute(INCIDENT_SUMMARY_SQL, {"since": since}):
+            if kind == 'type':
+                type_counts[bucket] = n
+            elif kind == 'severity':
+                severity_counts[bucket] = n
+            elif kind == 'open':
+                open_incidents = n
+            else:
+                insp_count, insp_avg = n, avg_score
 
-            return {
-                'by_type': type_counts,
-                'by_severity': severity_counts,
-                'open_incidents': open_incidents,
-                'total_incidents': sum(type_counts.values()),
-                'recent_inspections_count': int(insp_rows.cnt or 0),
-                'recent_inspections_avg_score': round(float(insp_rows.avg_score or 0), 2)
-            }
-        finally:
-            session.close()
+        return {
+            'by_type': type_counts,
+            'by_severity': severity_counts,
+            'open_incidents': open_incidents,
+            'total_incidents': sum(type_counts.values()),
+            'recent_inspections_count': int(insp_count or 0),
+            'recent_inspections_avg_score': _r2(float(insp_avg or 0))
+        }
     
     @staticmethod
     def get_staff_qualifications() -> Dict[str, Any]:
         """Analyze staff qualifications and distribution."""
-        session = get_session()
-        try:
-            # Get counts by role
-            role_counts = dict(
-                session.query(
-                    Staff.role,
-                    func.count(Staff.id)
-                ).group_by(Staff.role).all()
-            )
-            
-            # Count staff by qualification level
-            # Note: This assumes qualifications are stored in a consistent format
-            qualified_staff = session.query(func.count(Staff.id)).filter(
-                Staff.qualifications.op('?')('degree')
-            ).scalar()
-            
-            return {
-                'role_distribution': role_counts,
-                'total_staff': sum(role_counts.values()),
-                'qualified_staff': qualified_staff
-            }
-        finally:
-            session.close()
+        session = Session()
+        role_counts = {}
+        qualified_staff = 0
+        # Note: This assumes qualifications are stored in a consistent format
+        for is_total, role, n, qualified in session.execute(STAFF_QUALIFICATIONS_SQL):
+            if is_total:
+                qualified_staff = qualified
+            else:
+                role_counts[role] = n
+        
+        return {
+            'role_distribution': role_counts,
+            'total_staff': sum(role_counts.values()),
+            'qualified_staff': qualified_staff
+        }
 
     @staticmethod
     def get_school_coverage_analysis() -> Dict[str, Any]:
         """Analyze school coverage and accessibility."""
-        session = get_session()
-        try:
-            # Get average distance between schools
-            avg_distance = session.query(
-                func.avg(
-                    func.ST_Distance(
-                        School.geom,
-                        func.ST_Transform(
-                            func.ST_SetSRID(
-                                func.ST_MakePoint(36.817223, -1.286389),
-                                4326
-                            ),
-                            3857
-                        )
-                    )
-                )
-            ).scalar()
-            
-            # Get schools per county
-            schools_per_county = dict(
-                session.query(
-                    School.county,
-                    func.count(School.id)
-                ).group_by(School.county).all()
-            )
-            
-            return {
-                'average_distance_km': round(avg_distance / 1000, 2),
-                'schools_per_county': schools_per_county,
-                'total_counties': len(schools_per_county)
-            }
-        finally:
-            session.close()
\ No newline at end of file
+        session = Session()
+        # Average great-circle distance to the reference point. The point is
+        # built once from bound parameters and compared with the stored
+        # geography column, so no row is cast or transformed per query.
+        avg_distance = session.execute(AVG_DISTANCE_SQL, {
+            'lon': REFERENCE_LON, 'lat': REFERENCE_LAT,
+        }).scalar()
+        
+        # Get schools per county
+        schools_per_county = dict(
+            session.query(
+                School.county,
+                func.count(School.id)
+            ).group_by(School.county).all()
+        )
+        
+        return {
+            'average_distance_km': _r2((avg_distance or 0) / 1000),
+            'schools_per_county': schools_per_county,
+            'total_counties': len(schools_per_county)
+        }
@@ -1,18 +1,61 @@
+import base64
+import hashlib
+import hmac
+
+from argon2 import PasswordHasher
 from passlib.hash import pbkdf2_sha256
 from db import get_session
 from models import User
 
+# New passwords are hashed with argon2id (64 MiB, 2 passes, 2 lanes); older
+# PBKDF2 hashes still verify and are replaced on the user's next login.
+ARGON2_PREFIX = '$argon2'
+_argon2 = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
+# Legacy hashes use passlib's "$pbkdf2-sha256$<rounds>$<salt>$<checksum>" format
+PBKDF2_PREFIX = '$pbkdf2-sha256$'
+
+
+def _ab64_decode(data: str) -> bytes:
+    # passlib's "adapted base64": '.' instead of '+', no padding
+    data = data.replace('.', '+')
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+
 class AuthService:
     @staticmethod
     def verify_password(user: User, password: str) -> bool:
         try:
-            return pbkdf2_sha256.verify(password, user.password_hash)
+            stored = user.password_hash
+            if stored.startswith(ARGON2_PREFIX):
+                return _argon2.verify(stored, password)
+            if stored.startswith(PBKDF2_PREFIX):
+                # hashlib's PBKDF2 runs the rounds inside OpenSSL
+                rounds, salt, checksum = stored[len(PBKDF2_PREFIX):].split('$')
+                expected = _ab64_decode(checksum)
+                derived = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), _ab64_decode(salt),
+                                              int(rounds), dklen=len(expected))
+                return hmac.compare_digest(derived, expected)
+            # anything else is left to passlib
+            return pbkdf2_sha256.verify(password, stored)
         except Exception:
+            # argon2 raises on mismatch as well as on malformed hashes
             return False
 
+    @staticmethod
+    def needs_rehash(user: User) -> bool:
+        """True if the stored hash is legacy PBKDF2 or uses outdated argon2 parameters."""
+        stored = user.password_hash or ''
+        if not stored.startswith(ARGON2_PREFIX):
+            return True
+        try:
+            return _argon2.check_needs_rehash(stored)
+        except Exception:
+            return True
+
     @staticmethod
     def hash_password(password: str) -> str:
-        return pbkdf2_sha256.hash(password)
+        return _argon2.hash(password)
 
     @staticmethod
     def create_user(username: str, password: str, role: str = 'viewer', full_name: str = None, email: str = None):
@@ -1,34 +1,186 @@
+import hashlib
+import os
+import pickle
 import time
 import threading
+from collections import OrderedDict
 
-_cache = {}
-_lock = threading.Lock()
+from services import json_provider
+
+# The cache is split into shards, each an LRU with its own lock, so concurrent
+# requests for different keys rarely contend on the same lock
+SHARDS = 16
+# total entries across all shards; the least recently used are evicted beyond it
+MAX_ENTRIES = 10000
+_shard_max = MAX_ENTRIES // SHARDS
+# key -> (expires_at, value), least recently used first
+_shards = [(OrderedDict(), threading.Lock()) for _ in range(SHARDS)]
+# key -> Event for values being computed right now, guarded by the key's shard lock
+_inflight = [{} for _ in range(SHARDS)]
+
+
+# Values stored with set_shared() are shared across gunicorn workers through
+# Redis when REDIS_URL is set; otherwise they live in this process's cache.
+REDIS_URL = os.environ.get("REDIS_URL")
+
+_redis = None
+if REDIS_URL:
+    try:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL)
+    except Exception as e:
+        print(f"Warning: Redis unavailable, using in-process cache: {e}")
+        _redis = None
+
+
+def _shard(key: str):
+    return _shards[hash(key) % SHARDS]
+
+
+def _claim(key: str):
+    """Return (event, True) if the caller should compute key, or (event, False) to wait on another thread."""
+    i = hash(key) % SHARDS
+    with _shards[i][1]:
+        event = _inflight[i].get(key)
+        if event is not None:
+            return event, False
+        event = _inflight[i][key] = threading.Event()
+        return event, True
+
+
+def _release(key: str, event):
+    i = hash(key) % SHARDS
+    with _shards[i][1]:
+        _inflight[i].pop(key, None)
+    event.set()
+
+
+def _get(key: str, now: float):
+    entries, lock = _shard(key)
+    with lock:
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return entry
+
+
+def _put(key: str, ttl: int, value, now: float):
+    entries, lock = _shard(key)
+    with lock:
+        entries[key] = (now + ttl, value)
+        entries.move_to_end(key)
+        while len(entries) > _shard_max:
+            entries.popitem(last=False)
 
 
 def cache_response(key: str, ttl: int, value_func):
     """Simple cache helper: returns cached value for key if not expired, else calls value_func to compute and cache it."""
-    now = time.time()
-    with _lock:
-        entry = _cache.get(key)
-        if entry and entry[0] > now:
+    while True:
+        entry = _get(key, time.time())
+        if entry is not None:
             return entry[1]
-    # compute outside lock
-    val = value_func()
-    with _lock:
-        _cache[key] = (now + ttl, val)
-    return val
+        # single flight: concurrent misses on the same key wait for one computation
+        event, owner = _claim(key)
+        if not owner:
+            event.wait()
+            # re-read; if the owner failed, one of the waiters takes over
+            continue
+        try:
+            entry = _get(key, time.time())
+            if entry is not None:
+                return entry[1]
+            # compute outside lock
+            val = value_func()
+            _put(key, ttl, val, time.time())
+            return val
+        finally:
+            _release(key, event)
+
+
+def cache_json(key: str, ttl: int, value_func) -> bytes:
+    """Like cache_response, but caches the encoded JSON bytes so hits skip serialization.
+
+    value_func may also return JSON text that is already encoded (e.g. built by
+    PostgreSQL); it is stored as UTF-8 bytes unchanged.
+    """
+    def compute():
+        val = value_func()
+        if isinstance(val, bytes):
+            return val
+        if isinstance(val, str):
+            return val.encode('utf-8')
+        return json_provider.encode(val)
+    return cache_response(key, ttl, compute)
+
+
+def invalidate(key: str):
+    """Drop a single cached entry, if present."""
+    entries, lock = _shard(key)
+    with lock:
+        entries.pop(key, None)
+
+
+def get_shared(key: str):
+    """Return the bytes stored under key by set_shared(), or None on a miss."""
+    if _redis is not None:
+        try:
+            return _redis.get(key)
+        except Exception as e:
+            print(f"Warning: Redis get failed: {e}")
+            return None
+    entry = _get(key, time.time())
+    return entry[1] if entry is not None else None
+
+
+def set_shared(key: str, value: bytes, ttl: int):
+    """Store bytes under key for ttl seconds."""
+    if _redis is not None:
+        try:
+            _redis.setex(key, ttl, value)
+        except Exception as e:
+            print(f"Warning: Redis set failed: {e}")
+        return
+    _put(key, ttl, value, time.time())
+
+
+def delete_shared(key: str):
+    """Drop the entry stored under key by set_shared(), if present."""
+    if _redis is not None:
+        try:
+            _redis.delete(key)
+        except Exception as e:
+            print(f"Warning: Redis delete failed: {e}")
+        return
+    invalidate(key)
 
 
 def clear_cache():
-    with _lock:
-        _cache.clear()
+    for entries, lock in _shards:
+        with lock:
+            entries.clear()
+
+
+def call_key(func, args, kwargs) -> str:
+    """Cache key for a call: the function's qualified name plus a digest of its arguments.
+
+    Pickling keeps types and tuple structure apart ('a' vs ('a',), 1 vs '1'),
+    which str() of the arguments does not; kwargs are sorted so order is irrelevant.
+    """
+    try:
+        payload = pickle.dumps((args, sorted(kwargs.items())), protocol=5)
+    except Exception:
+        payload = repr((args, sorted(kwargs.items()))).encode('utf-8')
+    return func.__qualname__ + ':' + hashlib.blake2b(payload, digest_size=16).hexdigest()
 
 
 def make_cache_decorator(ttl: int = 30):
     def decorator(func):
         def wrapper(*args, **kwargs):
-            # build a simple key from function name and args/kwargs
-            key = func.__name__ + '|' + str(args) + '|' + str(kwargs)
+            key = call_key(func, args, kwargs)
             return cache_response(key, ttl, lambda: func(*args, **kwargs))
         wrapper.__name__ = func.__name__
         return wrapper
@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Rows per distance tile: bounds the (chunk, K) matrix regardless of N
+ASSIGN_CHUNK = 16384
+# NumPy releases the GIL inside matmul/argmin, so tiles run in parallel threads
+_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='kmeans')
+
+
+def kmeans_pp_init(pts: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Pick k initial centroids with k-means++ (D^2-weighted) seeding."""
+    centroids = np.empty((k, pts.shape[1]), dtype=pts.dtype)
+    centroids[0] = pts[rng.integers(len(pts))]
+    d2 = ((pts - centroids[0]) ** 2).sum(1)
+    for i in range(1, k):
+        total = d2.sum()
+        idx = rng.choice(len(pts), p=d2 / total) if total > 0 else rng.integers(len(pts))
+        centroids[i] = pts[idx]
+        d2 = np.minimum(d2, ((pts - centroids[i]) ** 2).sum(1))
+    return centroids
+
+
+def assign_labels(pts: np.ndarray, pts_sq: np.ndarray, centroids: np.ndarray, chunk: int = ASSIGN_CHUNK) -> np.ndarray:
+    """Index of the nearest centroid for every point.
+
+    Squared distances use ||p||^2 + ||c||^2 - 2 p.c so each tile is one GEMM;
+    only a (chunk, K) block per worker thread is ever materialized.
+    """
+    c_sq = (centroids * centroids).sum(1)[None, :]
+    labels = np.empty(len(pts), dtype=np.intp)
+
+    def tile(start):
+        stop = start + chunk
+        d2 = pts_sq[start:stop] + c_sq - 2.0 * (pts[start:stop] @ centroids.T)
+        labels[start:stop] = d2.argmin(1)
+
+    starts = range(0, len(pts), chunk)
+    if len(starts) == 1:
+        tile(0)
+    else:
+        # each tile writes a disjoint slice of labels, so no reduction is needed
+        list(_pool.map(tile, starts))
+    return labels
+
+
+def lloyd(pts: np.ndarray, k: int, iters: int = 10, rng: np.random.Generator = None, tol: float = 1e-9):
+    """Vectorized Lloyd's k-means over an (N, 2) float array.
+
+    Seeds with k-means++ and stops early once centroids stop moving.
+    Returns (centroids, counts) where centroids is (K, 2) and counts holds the
+    number of points assigned to each centroid; both are empty when k <= 0 or
+    there are no points.
+    """
+    rng = rng or np.random.default_rng()
+    k = min(k, len(pts))
+    if k <= 0:
+        return np.empty((0, 2)), np.zeros(0, dtype=np.int64)
+    centroids = kmeans_pp_init(pts, k, rng)
+    pts_sq = (pts * pts).sum(1)[:, None]
+    counts = np.zeros(k, dtype=np.int64)
+    for _ in range(iters):
+        labels = assign_labels(pts, pts_sq, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, pts)
+        counts = np.bincount(labels, minlength=k)
+        mask = counts > 0
+        # empty clusters keep their previous centroid
+        updated = centroids.copy()
+        updated[mask] = sums[mask] / counts[mask, None]
+        shift = ((updated - centroids) ** 2).sum()
+        centroids = updated
+        if shift <= tol:
+            break
+    return centroids, counts
@@ -0,0 +1,155 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+# Nominatim lookups are shared across gunicorn workers through Redis when
+# REDIS_URL is set; otherwise they fall back to an in-process LRU that is
+# persisted to a JSON file on local disk.
+REDIS_URL = os.environ.get("REDIS_URL")
+GEOCODE_TTL = int(os.environ.get("GEOCODE_CACHE_TTL", 86400))
+GEOCODE_MAXSIZE = int(os.environ.get("GEOCODE_CACHE_MAXSIZE", 2048))
+CACHE_FILE = "nominatim_cache.json"
+# The file is rewritten by a background thread, at most once per SAVE_INTERVAL
+# seconds (sooner after SAVE_EVERY writes), so misses never wait on disk I/O
+SAVE_INTERVAL = 5.0
+SAVE_EVERY = 50
+KEY_PREFIX = "nom:"
+
+_redis = None
+if REDIS_URL:
+    try:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL)
+    except Exception as e:
+        print(f"Warning: Redis unavailable, using file cache: {e}")
+        _redis = None
+
+# key -> (expires_at, value), least recently used first
+_local = OrderedDict()
+# guards _local only; never held during file I/O
+_lock = threading.Lock()
+# one item per set(); the writer drains it and saves once per burst
+_writes = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _load_file():
+    now = time.time()
+    try:
+        if os.path.exists(CACHE_FILE):
+            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key, entry in data.items():
+                if isinstance(entry, dict) and 'e' in entry:
+                    if entry['e'] > now:
+                        _local[key] = (entry['e'], entry['v'])
+                else:
+                    # entries written before expiry was tracked
+                    _local[key] = (now + GEOCODE_TTL, entry)
+            while len(_local) > GEOCODE_MAXSIZE:
+                _local.popitem(last=False)
+    except Exception:
+        _local.clear()
+
+
+def _save_file(snapshot):
+    # write a private temp file and swap it in, so concurrent saves cannot interleave
+    tmp = f"{CACHE_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({k: {'e': e, 'v': v} for k, (e, v) in snapshot.items()}, f)
+        os.replace(tmp, CACHE_FILE)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def get(key: str):
+    """Return the cached lookup for key, or None on a miss."""
+    if _redis is not None:
+        try:
+            v = _redis.get(KEY_PREFIX + key)
+            return json.loads(v) if v else None
+        except Exception as e:
+            print(f"Warning: Redis get failed: {e}")
+            return None
+    with _lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return entry[1]
+
+
+def set(key: str, value):
+    """Store a lookup; entries expire after GEOCODE_TTL seconds."""
+    if _redis is not None:
+        try:
+            _redis.setex(KEY_PREFIX + key, GEOCODE_TTL, json.dumps(value))
+        except Exception as e:
+            print(f"Warning: Redis set failed: {e}")
+        return
+    with _lock:
+        _local[key] = (time.time() + GEOCODE_TTL, value)
+        _local.move_to_end(key)
+        while len(_local) > GEOCODE_MAXSIZE:
+            _local.popitem(last=False)
+    _start_writer()
+    _writes.put(key)
+
+
+def _flush():
+    with _lock:
+        snapshot = dict(_local)
+    _save_file(snapshot)
+
+
+def _writer_loop():
+    while True:
+        _writes.get()
+        pending = 1
+        deadline = time.monotonic() + SAVE_INTERVAL
+        # coalesce the rest of the burst into the same save
+        while pending < SAVE_EVERY:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                _writes.get(timeout=timeout)
+                pending += 1
+            except queue.Empty:
+                break
+        _flush()
+
+
+def _start_writer():
+    # started lazily so each forked worker gets its own thread
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name='geocache-writer', daemon=True)
+            _writer.start()
+
+
+def _flush_at_exit():
+    # the daemon writer dies with the process; save what it had not written yet
+    if _writer is not None:
+        _flush()
+
+
+if _redis is None:
+    _load_file()
+    # registered once here, not per writer start, so restarts add no extra hooks
+    atexit.register(_flush_at_exit)
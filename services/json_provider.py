@@ -0,0 +1,39 @@
+import decimal
+
+import orjson
+from flask.json.provider import JSONProvider
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    # NUMERIC columns (SUM/AVG aggregates) come back as Decimal
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def encode(obj) -> bytes:
+    """Serialize obj to JSON bytes with the app's orjson options."""
+    return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, so every jsonify() call encodes in C."""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # hand orjson's bytes straight to the response, skipping the str round-trip
+        return self._app.response_class(encode(obj), mimetype=self.mimetype)
@@ -1,13 +0,0 @@
-from setuptools import setup, find_packages
-
-# Read requirements from requirements.txt
-with open('requirements.txt') as f:
-    requirements = f.read().splitlines()
-
-setup(
-    name="schools_app",
-    version="0.1.0",
-    packages=find_packages(),
-    install_requires=requirements,
-    python_requires=">=3.8",
-)
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""Static checks on the raw SQL constants.
+
+The statements are read out of the source with ast, so these tests need
+neither a database nor the app's dependencies.
+"""
+import ast
+import os
+import re
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# columns that both the `params` CTE and the schools table expose
+PARAM_COLUMNS = ("county", "school_type")
+CTE_START = re.compile(r"\b(\w+)\s+AS\s*\(", re.IGNORECASE)
+BARE_COLUMN = re.compile(r"(?<![\w.:])(%s)\b" % "|".join(PARAM_COLUMNS))
+ALIAS_DEF = re.compile(r"\bAS\s+$", re.IGNORECASE)
+
+
+def sql_constants(relpath):
+    """Return {name: sql} for module-level NAME = text("...") assignments."""
+    with open(os.path.join(ROOT, relpath), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    found = {}
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)):
+            continue
+        call = node.value
+        if getattr(call.func, "id", None) != "text" or not call.args:
+            continue
+        arg = call.args[0]
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    found[target.id] = arg.value
+    return found
+
+
+def cte_bodies(sql):
+    """Yield (name, body) for each CTE in a WITH statement."""
+    pos = 0
+    while True:
+        m = CTE_START.search(sql, pos)
+        if not m:
+            return
+        depth, i = 1, m.end()
+        while depth and i < len(sql):
+            depth += {"(": 1, ")": -1}.get(sql[i], 0)
+            i += 1
+        yield m.group(1), sql[m.end():i - 1]
+        pos = i
+
+
+def ambiguous_refs(sql):
+    """Unqualified params columns inside CTEs that also read `params p`."""
+    refs = []
+    for name, body in cte_bodies(sql):
+        if name == "params" or not re.search(r"\bparams\s+p\b", body):
+            continue
+        for m in BARE_COLUMN.finditer(body):
+            if not ALIAS_DEF.search(body[:m.start()]):
+                refs.append((name, m.group(1)))
+    return refs
+
+
+class ParamsCteQualificationTest(unittest.TestCase):
+    """CTEs joining `params p` must qualify county/school_type, or PostgreSQL
+    rejects the statement with "column reference is ambiguous"."""
+
+    def assert_qualified(self, relpath, name):
+        sql = sql_constants(relpath)[name]
+        self.assertIn("params p", sql)
+        self.assertEqual(ambiguous_refs(sql), [])
+
+    def test_dashboard_sql(self):
+        self.assert_qualified("main.py", "DASHBOARD_SQL")
+
+    def test_enrollment_stats_sql(self):
+        self.assert_qualified(os.path.join("services", "analytics.py"), "ENROLLMENT_STATS_SQL")
+
+    def test_check_detects_unqualified_column(self):
+        sql = "WITH params AS (SELECT 1 AS county), cur AS (SELECT 1 FROM schools, params p WHERE county = p.county) SELECT 1"
+        self.assertEqual(ambiguous_refs(sql), [("cur", "county")])
+
+
+if __name__ == "__main__":
+    unittest.main()